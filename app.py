@@ -1,69 +1,799 @@
 # app.py
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 import os
+import sys
 import base64
+import argparse
 from vosk import Model, KaldiRecognizer
 import json
 import subprocess
+import gc
+import time
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+import urllib.request
+
+from assistant_config import BASE_DIR, MODEL_CONFIGS, build_system_prompt, load_config, save_config
+from commands import router, web
+from conversations import ConversationStore
+from downloader import download_model, is_complete
+from jobs import BACKGROUND, INTERACTIVE, NORMAL, JobQueue, QueueFull
+from metrics import current_trace, end_trace, record_span, registry, span, start_trace
+from phi3_engine import fallback_reply, load_engine
+from model_selector import (
+    MEMORY_PRESSURE_BYTES, TARGET_TOKENS_PER_SECOND,
+    available_memory, installed_variants, lighter_variant, select_variant
+)
+from response_cache import ResponseCache, make_key
+from transcription import PoolBusy, RecognizerPool, read_wav, resample_pcm, transcribe_pcm
 
 app = Flask(__name__)
 
+# WebSocket opzionale (flask-sock): senza, resta solo /transcribe via POST
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    sock = Sock(app)
+except ImportError:
+    sock = None
+
+# --- SERVER ---
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 5000
+SERVER_URL = f"http://localhost:{SERVER_PORT}"
+
+# --- METRICHE ---
+# Esposte su /metrics in formato Prometheus; le tracce per richiesta si attivano con
+# l'header X-Trace (o ?trace=1) oppure per tutte le richieste con --trace
+REQUEST_SECONDS = registry.histogram(
+    "arcadia_http_request_duration_seconds", "Durata delle richieste HTTP, streaming compreso",
+    ["route", "method", "status"])
+VOSK_RTF = registry.histogram(
+    "arcadia_vosk_real_time_factor", "Tempo di decodifica Vosk diviso per la durata dell'audio",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5))
+LLM_PREFILL_SECONDS = registry.histogram(
+    "arcadia_llm_prefill_seconds", "Tempo fino al primo token (prefill del prompt)", ["model"])
+LLM_DECODE_SECONDS = registry.histogram(
+    "arcadia_llm_decode_seconds", "Tempo di generazione dopo il primo token", ["model"])
+LLM_TOKENS = registry.counter(
+    "arcadia_llm_tokens_total", "Token generati dal modello", ["model"])
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "arcadia_llm_tokens_per_second", "Velocità di decodifica per risposta", ["model"],
+    buckets=(1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50))
+MODEL_LOAD_SECONDS = registry.gauge(
+    "arcadia_model_load_seconds", "Durata dell'ultimo caricamento di ciascun modello", ["model"])
+trace_all = False
+
+
+SAMPLE_RATE = 16000
+
+# Riconoscitori condivisi: uno per core, più una coda limitata di richieste in attesa
+ASR_WORKERS = os.cpu_count() or 2
+ASR_MAX_WAITING = ASR_WORKERS * 2
+
 # Percorso al modello Vosk
-VOSK_MODEL_PATH = "assets/models/vosk-model-small-it"
+VOSK_MODEL_PATH = str(BASE_DIR / "assets" / "models" / "vosk-model-small-it")
 model = None
+recognizer_pool = None
+
+# I modelli vengono caricati una sola volta per processo, anche con richieste concorrenti
+vosk_lock = threading.Lock()
+phi3_lock = threading.Lock()
+models_ready = threading.Event()
+
+# Avanzamento del caricamento di Phi-3, mostrato dalla GUI e dal launcher
+PHI3_TOKENIZER_DIR = str(BASE_DIR / "assets" / "models" / "phi3-tokenizer")
+load_status = {"stage": "in attesa", "progress": 0}
+
+def report_progress(stage, percent):
+    load_status.update(stage=stage, progress=percent)
+    print(f"🔄 Phi-3: {stage} ({percent}%)")
 
 # Carica il modello Vosk una volta
 def load_vosk_model():
     global model
-    if not model and os.path.exists(VOSK_MODEL_PATH):
-        print("🔄 Caricamento modello Vosk...")
-        model = Model(VOSK_MODEL_PATH)
+    with vosk_lock:
+        if not model and os.path.exists(VOSK_MODEL_PATH):
+            print("🔄 Caricamento modello Vosk...")
+            with MODEL_LOAD_SECONDS.time(model="vosk"):
+                model = Model(VOSK_MODEL_PATH)
     return model
 
+def load_recognizer_pool():
+    """Pool di KaldiRecognizer pre-costruiti sul modello Vosk"""
+    global recognizer_pool
+    vosk_model = load_vosk_model()
+    with vosk_lock:
+        if not recognizer_pool and vosk_model:
+            recognizer_pool = RecognizerPool(
+                lambda: KaldiRecognizer(vosk_model, SAMPLE_RATE),
+                size=ASR_WORKERS,
+                max_waiting=ASR_MAX_WAITING
+            )
+    return recognizer_pool
+
+# Motore Phi-3 (caricato all'avvio del server o alla prima richiesta di chat)
+phi3_engine = None
+phi3_model_key = None
+
+# Parametri di generazione per /chat (fanno parte della chiave di cache)
+CHAT_SAMPLING = {"max_new_tokens": 256, "temperature": 0.7, "top_p": 0.9}
+
+# Cache delle risposte, conservata tra un riavvio e l'altro
+RESPONSE_CACHE_PATH = str(BASE_DIR / "response_cache.json")
+response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+atexit.register(response_cache.save)
+
+# Scelte da riga di comando (es. dal benchmark): variante fissa, cache delle risposte disattivabile
+model_override = None
+response_cache_enabled = True
+disable_prepacking = False  # Da attivare solo se il benchmark ne conferma il vantaggio
+
+# Cronologia delle chat per id di sessione (inviato da gui.html)
+conversations = ConversationStore()
+
+def open_variant(model_key):
+    """Carica una variante di MODEL_CONFIGS con prompt di sistema e riscaldamento"""
+    print(f"🔄 Caricamento modello Phi-3 ({model_key})...")
+    with MODEL_LOAD_SECONDS.time(model=model_key):
+        return load_engine(
+            BASE_DIR / MODEL_CONFIGS[model_key]["path"],
+            system_prompt=build_system_prompt(),
+            tokenizer_dir=PHI3_TOKENIZER_DIR,
+            progress=report_progress,
+            disable_prepacking=disable_prepacking
+        )
+
+def choose_auto_variant(config):
+    """Modalità "auto": variante scelta da RAM libera e token/s misurati (misure salvate nel config)"""
+    candidates = installed_variants(str(BASE_DIR))
+    if not candidates:
+        return None, None
+    measurements = config.setdefault("model_calibration", {})
+    model_key, engine = select_variant(
+        candidates, open_variant, measurements, str(BASE_DIR),
+        target=config.get("target_tokens_per_second", TARGET_TOKENS_PER_SECOND),
+        free_memory=available_memory()
+    )
+    save_config(config)
+    print(f"✅ Variante automatica: {model_key}")
+    return model_key, engine
+
+def load_phi3_engine():
+    global phi3_engine, phi3_model_key
+    with phi3_lock:
+        if not phi3_engine:
+            config = load_config()
+            model_version = model_override or config.get("model_version", "balanced")
+            try:
+                if model_version == "auto":
+                    model_key, engine = choose_auto_variant(config)
+                else:
+                    model_key, engine = model_version, None
+                if not model_key or not is_complete(BASE_DIR / MODEL_CONFIGS[model_key]["path"]):
+                    load_status.update(stage="modello non installato", progress=0)
+                    return None
+                phi3_engine = engine or open_variant(model_key)
+                phi3_model_key = model_key
+            except Exception as e:
+                load_status.update(stage="errore", progress=0)
+                print(f"❌ Errore caricamento Phi-3: {e}")
+    return phi3_engine
+
+def swap_phi3_engine(model_key=None):
+    """Cambia modello a caldo, senza riavvio (None = rileggi la scelta dal config)"""
+    global phi3_engine, phi3_model_key
+    with phi3_lock:
+        if model_key and model_key == phi3_model_key:
+            return phi3_engine
+        # Prima si libera la memoria del modello attuale: le sessioni ne trattengono il motore
+        # e la KV-cache, quindi vanno scartate; le generazioni in corso ne conservano
+        # un riferimento e terminano normalmente
+        conversations.clear()
+        phi3_engine = None
+        phi3_model_key = None
+        gc.collect()
+        if model_key:
+            try:
+                phi3_engine = open_variant(model_key)
+                phi3_model_key = model_key
+            except Exception as e:
+                load_status.update(stage="errore", progress=0)
+                print(f"❌ Errore caricamento Phi-3: {e}")
+    return phi3_engine if model_key else load_phi3_engine()
+
+# Controllo periodico della memoria in modalità automatica
+MEMORY_CHECK_INTERVAL = 30
+
+def watch_memory_pressure():
+    """Con poca RAM libera passa alla variante installata più leggera"""
+    while True:
+        time.sleep(MEMORY_CHECK_INTERVAL)
+        if phi3_model_key is None or load_config().get("model_version") != "auto":
+            continue
+        free_memory = available_memory()
+        if free_memory is not None and free_memory < MEMORY_PRESSURE_BYTES:
+            lighter = lighter_variant(phi3_model_key, installed_variants(str(BASE_DIR)))
+            if lighter:
+                print(f"⚠️ Memoria in esaurimento ({free_memory // 2**20} MB): passo a {lighter}")
+                swap_phi3_engine(lighter)
+
+def load_models():
+    """Carica Vosk e Phi-3 in parallelo e segnala che il server è pronto"""
+    def load_vosk():
+        try:
+            load_recognizer_pool()
+        except Exception as e:
+            print(f"❌ Errore caricamento Vosk: {e}")
+
+    vosk_thread = threading.Thread(target=load_vosk, daemon=True)
+    vosk_thread.start()
+    load_phi3_engine()
+    vosk_thread.join()
+    models_ready.set()
+    print("✅ Modelli pronti")
+    threading.Thread(target=watch_memory_pressure, daemon=True).start()
+
+def sse_event(payload):
+    """Formatta un evento Server-Sent Events"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
 @app.route('/')
 def index():
     return send_file('gui.html')
 
+@app.route('/health')
+def health():
+    """Sonda di prontezza interrogata dal launcher"""
+    return jsonify({
+        "ready": models_ready.is_set(),
+        "vosk": model is not None,
+        "phi3": phi3_engine is not None,
+        "model": phi3_model_key,
+        "loading": load_status,
+        "download": download_status,
+        "streaming": sock is not None,
+        "cache": response_cache.stats(),
+        "sessions": len(conversations),
+        "web": web.stats(),
+        "jobs": jobs.stats()
+    })
+
+def cache_stats():
+    """Hit e miss di tutte le cache; quella degli allegati solo se vision.py è già stato caricato"""
+    caches = {"risposte": response_cache.stats(), "web": web.stats()}
+    for module_name, read in (("tts", lambda m: m.speaker.stats()),
+                              ("vision", lambda m: m.get_attachment_cache().stats())):
+        module = sys.modules.get(module_name)
+        if module is not None:
+            caches["allegati" if module_name == "vision" else module_name] = read(module)
+    return caches
+
+registry.counter("arcadia_cache_hits_total", "Richieste servite dalla cache", ["cache"],
+                 lambda: {name: stats["hits"] for name, stats in cache_stats().items()})
+registry.counter("arcadia_cache_misses_total", "Richieste non trovate in cache", ["cache"],
+                 lambda: {name: stats["misses"] for name, stats in cache_stats().items()})
+registry.gauge("arcadia_jobs", "Lavori in background per stato", ["status"],
+               lambda: {status: count for status, count in jobs.stats().items() if status != "workers"})
+registry.gauge("arcadia_asr_recognizers_in_use", "Riconoscitori Vosk in uso",
+               function=lambda: recognizer_pool.in_use if recognizer_pool else None)
+registry.gauge("arcadia_web_requests_inflight", "Richieste ai servizi esterni in corso",
+               function=lambda: web.stats()["inflight"])
+registry.gauge("arcadia_chat_sessions", "Conversazioni in memoria", function=lambda: len(conversations))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if trace_all or request.headers.get("X-Trace") or request.args.get("trace"):
+        start_trace(f"{request.method} {request.path}")
+
+@app.after_request
+def record_request(response):
+    """Durata registrata alla chiusura della risposta, così le risposte in streaming contano per intero"""
+    start = g.get("request_start", time.perf_counter())
+    labels = {"route": request.url_rule.rule if request.url_rule else "sconosciuta",
+              "method": request.method, "status": response.status_code}
+    trace = current_trace()
+    if trace is not None and not response.is_streamed:
+        response.headers["Server-Timing"] = trace.server_timing()
+
+    def finish():
+        REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+        if trace is not None and end_trace() is trace:
+            print(f"🔍 {trace.summary()}")
+
+    response.call_on_close(finish)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+def timed_transcription(rec, pcm):
+    """transcribe_pcm con il fattore tempo reale registrato nelle metriche"""
+    start = time.perf_counter()
+    text = transcribe_pcm(rec, pcm)
+    end = time.perf_counter()
+    record_span("asr", start, end)
+    seconds = len(pcm) / 2 / SAMPLE_RATE
+    if seconds:
+        VOSK_RTF.observe((end - start) / seconds)
+    return text
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     data = request.get_json()
     audio_data_b64 = data.get('audio', '')
 
-    # Decodifica l'audio da base64
-    audio_data = base64.b64decode(audio_data_b64.split(',')[1])  # Rimuove "data:audio/wav;base64,"
+    # Decodifica l'audio da base64 (rimuove "data:audio/wav;base64,")
+    audio_data = base64.b64decode(audio_data_b64.split(',')[-1])
 
-    # Salva temporaneamente
-    with open("temp.wav", "wb") as f:
-        f.write(audio_data)
-
-    # Trascrivi con Vosk
-    vosk_model = load_vosk_model()
-    if not vosk_model:
+    pool = load_recognizer_pool()
+    if not pool:
         return jsonify({"error": "Modello Vosk non trovato"})
 
-    rec = KaldiRecognizer(vosk_model, 16000)
-    with open("temp.wav", "rb") as f:
-        f.read(44)  # Salta l'header WAV
-        data_chunk = f.read(8000)
-        final_text = ""
-        while data_chunk:
-            if rec.AcceptWaveform(data_chunk):
-                result = rec.Result()
-                final_text += json.loads(result)["text"] + " "
-            data_chunk = f.read(8000)
-        final_text += json.loads(rec.FinalResult())["text"]
+    try:
+        pcm, sample_rate = read_wav(audio_data)
+    except ValueError as e:
+        return jsonify({"error": f"Audio non valido: {e}"}), 400
+
+    try:
+        with pool.recognizer() as rec:
+            # Frequenze diverse da quella del pool si ricampionano: anche queste richieste
+            # passano dal pool limitato (e dalla sua risposta 503)
+            pcm = resample_pcm(pcm, sample_rate, SAMPLE_RATE)
+            text = timed_transcription(rec, pcm)
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({"text": text})
+
+def stream_transcription(ws):
+    """Riceve frame PCM dal browser e li passa subito a Vosk, inviando i risultati parziali"""
+    pool = load_recognizer_pool()
+    if not pool:
+        ws.send(json.dumps({"error": "Modello Vosk non trovato"}))
+        return
+
+    try:
+        with pool.recognizer() as rec:
+            receive_transcription(ws, rec)
+    except PoolBusy as e:
+        ws.send(json.dumps({"error": str(e)}))
+    except ConnectionClosed:
+        pass
+
+def receive_transcription(ws, rec, until_endpoint=False, marks=None):
+    """Passa a Vosk i frame ricevuti finché il browser non segnala la fine;
+    con until_endpoint si ferma al primo risultato finale (fine della frase rilevata da Vosk)"""
+    segments = []
+    last_partial = ""
+    while True:
+        frame = ws.receive()
+        # Un messaggio di testo segnala la fine della registrazione
+        if frame is None or isinstance(frame, str):
+            break
+        if marks is not None:
+            marks["speech_end"] = time.perf_counter()
+        if rec.AcceptWaveform(frame):
+            text = json.loads(rec.Result())["text"]
+            if text:
+                segments.append(text)
+                ws.send(json.dumps({"result": text}))
+                if until_endpoint:
+                    break
+            last_partial = ""
+        else:
+            partial = json.loads(rec.PartialResult())["partial"]
+            if partial != last_partial:
+                ws.send(json.dumps({"partial": partial}))
+                last_partial = partial
+    if not (until_endpoint and segments):
+        segments.append(json.loads(rec.FinalResult())["text"])
+    text = " ".join(s for s in segments if s)
+    if marks is not None:
+        marks["transcript"] = time.perf_counter()
+        marks.setdefault("speech_end", marks["transcript"])
+    ws.send(json.dumps({"text": text}))
+    return text
+
+if sock:
+    sock.route('/ws/transcribe')(stream_transcription)
+
+@app.route('/model', methods=['POST'])
+def change_model():
+    """Imposta la variante (o "auto") e la applica subito in background"""
+    version = request.get_json().get("model", "")
+    if version != "auto" and version not in MODEL_CONFIGS:
+        return jsonify({"error": f"Variante sconosciuta: {version}"}), 400
+    config = load_config()
+    config["model_version"] = version
+    save_config(config)
+    threading.Thread(target=swap_phi3_engine, daemon=True).start()
+    return jsonify({"model": version, "applying": True})
+
+# --- DOWNLOAD DEI MODELLI ---
+download_status = {"model": None, "downloaded": 0, "total": 0, "state": "inattivo"}
+download_lock = threading.Lock()
+
+def run_download(model_key):
+    def progress(downloaded, total):
+        download_status.update(downloaded=downloaded, total=total)
 
-    # Rimuovi il file temporaneo
-    os.remove("temp.wav")
+    try:
+        download_model(MODEL_CONFIGS[model_key], BASE_DIR, progress=progress)
+        download_status["state"] = "completato"
+        print(f"✅ Modello {model_key} scaricato")
+        # Se era la variante scelta e mancava, ora si può caricare
+        if phi3_engine is None:
+            load_phi3_engine()
+    except Exception as e:
+        download_status["state"] = f"errore: {e}"
+        print(f"❌ Download {model_key} fallito: {e}")
 
-    return jsonify({"text": final_text.strip()})
+def start_download(model_key):
+    """Avvia in background il download di una variante; False se un altro è già in corso"""
+    with download_lock:
+        if download_status["state"] == "in corso":
+            return False
+        download_status.update(model=model_key, downloaded=0, total=0, state="in corso")
+    threading.Thread(target=run_download, args=(model_key,), daemon=True).start()
+    return True
+
+# I comandi @modello e @scarica agiscono su questo modulo, anche quando gira come __main__
+router.bind(swap_model=swap_phi3_engine, start_download=start_download)
+
+@app.route('/download', methods=['GET', 'POST'])
+def download():
+    """POST {"model": chiave} avvia il download; GET restituisce l'avanzamento"""
+    if request.method == 'POST':
+        model_key = request.get_json().get("model", "")
+        if model_key not in MODEL_CONFIGS:
+            return jsonify({"error": f"Variante sconosciuta: {model_key}"}), 400
+        if not start_download(model_key):
+            return jsonify({"error": "Un download è già in corso", **download_status}), 409
+    return jsonify(download_status)
+
+def measure_generation(source, model_key, generations):
+    """Inoltra i frammenti del modello misurando prefill (fino al primo token) e decodifica.
+    I token si contano dagli id generati (output_ids) delle Generation in `generations`, non dai
+    frammenti: la detokenizzazione incrementale ne unisce più d'uno o trattiene quelli UTF-8 parziali."""
+    start = time.perf_counter()
+    first = None
+    try:
+        for piece in source:
+            if first is None:
+                first = time.perf_counter()
+                LLM_PREFILL_SECONDS.observe(first - start, model=model_key)
+                record_span("prefill", start, first)
+            yield piece
+    finally:
+        # Anche le generazioni interrotte dal client contano
+        if first is not None:
+            tokens = sum(len(generation.output_ids) for generation in generations)
+            decode = time.perf_counter() - first
+            record_span("decode", first)
+            LLM_DECODE_SECONDS.observe(decode, model=model_key)
+            LLM_TOKENS.inc(tokens, model=model_key)
+            if tokens > 1 and decode > 0:
+                LLM_TOKENS_PER_SECOND.observe((tokens - 1) / decode, model=model_key)
+
+def reply_stream(message, session_id=None):
+    """Frammenti della risposta: comandi @, poi cache se già vista, altrimenti dal modello"""
+    with span("comandi"):
+        command_reply = router.handle(message)
+    if command_reply is not None:
+        yield command_reply
+        return
+
+    engine = load_phi3_engine()
+    if not engine:
+        yield fallback_reply(message)
+        return
+
+    conversation = conversations.get(session_id, engine) if session_id else None
+
+    # La cache vale solo per domande senza cronologia precedente
+    use_cache = response_cache_enabled and (conversation is None or conversation.is_empty())
+    key = make_key(message, phi3_model_key, **CHAT_SAMPLING)
+    if use_cache:
+        with span("cache"):
+            cached = response_cache.get(key)
+        if cached is not None:
+            if conversation:
+                conversation.record_turn(message, cached)
+            yield cached
+            return
+
+    generations = []
+    if conversation:
+        source = conversation.stream(message, on_start=generations.append, **CHAT_SAMPLING)
+    else:
+        source = engine.stream_chat(message, **CHAT_SAMPLING)
+        generations.append(source)
+
+    pieces = []
+    for piece in measure_generation(source, phi3_model_key, generations):
+        pieces.append(piece)
+        yield piece
+    # Si arriva qui solo se la generazione non è stata interrotta
+    if use_cache:
+        response_cache.put(key, "".join(pieces).strip())
+
+def generate_reply(message, session_id=None):
+    """Risposta completa (con cache)"""
+    return "".join(reply_stream(message, session_id)).strip()
 
 @app.route('/chat', methods=['POST'])
 def chat():
     data = request.get_json()
     message = data.get("message", "").strip()
-    reply = "Ho ricevuto: " + message  # Sostituisci con Phi-3-mini
-    return jsonify({"reply": reply})
+    session_id = data.get("session_id")
+
+    if not data.get("stream"):
+        return jsonify({"reply": generate_reply(message, session_id)})
+
+    # Streaming: un evento per ogni frammento di testo generato
+    def events():
+        for piece in reply_stream(message, session_id):
+            yield sse_event({"token": piece})
+        yield sse_event({"done": True})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- TURNO VOCALE ---
+# Trascrizione, generazione e sintesi si sovrappongono: la risposta parte al risultato finale
+# di Vosk e ogni frase completata va in sintesi mentre il modello genera la successiva.
+VOICE_STAGES = {
+    "asr": ("speech_end", "transcript"),           # Fine del parlato → testo finale
+    "first_token": ("transcript", "first_token"),  # Prefill del prompt
+    "first_sentence": ("transcript", "first_sentence"),
+    "first_audio": ("transcript", "first_audio"),
+    "generation": ("transcript", "generated"),
+    "speech_to_audio": ("speech_end", "first_audio"),  # Attesa percepita dall'utente
+    "total": ("speech_end", "done")
+}
+
+def stage_timings(marks):
+    """Durate delle fasi in millisecondi (solo quelle effettivamente raggiunte)"""
+    return {stage: round((marks[end] - marks[start]) * 1000)
+            for stage, (start, end) in VOICE_STAGES.items() if start in marks and end in marks}
+
+def speak_reply(ws, message, session_id, marks):
+    """Inoltra i token al browser e passa ogni frase completa alla sintesi in un thread separato"""
+    from tts import SentenceChunker, audio_mime, speaker
+
+    send_lock = threading.Lock()  # I token e l'audio partono da due thread
+    def send(payload):
+        with send_lock:
+            ws.send(json.dumps(payload, ensure_ascii=False))
+
+    sentences = queue.Queue()
+    def synthesize():
+        while (sentence := sentences.get()) is not None:
+            audio = speaker.synthesize(sentence)
+            marks.setdefault("first_audio", time.perf_counter())
+            # Senza motori TTS il browser legge la frase con la sintesi vocale propria
+            send({"sentence": sentence,
+                  "audio": base64.b64encode(audio).decode("ascii") if audio else None,
+                  "mime": audio_mime(audio) if audio else None})
+
+    synthesizer = threading.Thread(target=synthesize, daemon=True)
+    synthesizer.start()
+    chunker = SentenceChunker()
+    try:
+        for piece in reply_stream(message, session_id):
+            marks.setdefault("first_token", time.perf_counter())
+            send({"token": piece})
+            for sentence in chunker.feed(piece):
+                marks.setdefault("first_sentence", time.perf_counter())
+                sentences.put(sentence)
+        for sentence in chunker.flush():
+            marks.setdefault("first_sentence", time.perf_counter())
+            sentences.put(sentence)
+        marks["generated"] = time.perf_counter()
+    finally:
+        sentences.put(None)
+        synthesizer.join()
+
+def stream_voice_turn(ws):
+    """Un turno di conversazione a voce: frame PCM in ingresso, token e audio delle frasi in uscita"""
+    pool = load_recognizer_pool()
+    if not pool:
+        ws.send(json.dumps({"error": "Modello Vosk non trovato"}))
+        return
+
+    session_id = request.args.get("session_id")
+    marks = {}
+    try:
+        # Il riconoscitore torna al pool prima della generazione
+        with pool.recognizer() as rec:
+            message = receive_transcription(ws, rec, until_endpoint=True, marks=marks)
+        if message:
+            speak_reply(ws, message, session_id, marks)
+        marks["done"] = time.perf_counter()
+        timings = stage_timings(marks)
+        print(f"🎙️ Turno vocale: {timings}")
+        ws.send(json.dumps({"done": True, "timings": timings}))
+    except PoolBusy as e:
+        ws.send(json.dumps({"error": str(e)}))
+    except ConnectionClosed:
+        pass
+
+if sock:
+    sock.route('/ws/voice')(stream_voice_turn)
+
+# --- LAVORI IN BACKGROUND ---
+# La chat interattiva passa davanti ai comandi, che passano davanti all'analisi degli allegati
+jobs = JobQueue()
+JOB_HEARTBEAT = 15  # Secondi tra due commenti SSE mentre il lavoro è in corso
+
+def describe_upload(filename, data_url, pages=None):
+    """Analizza un allegato ricevuto in base64 (vision.py)"""
+    from vision import describe_attachment
+
+    content = base64.b64decode(data_url.split(',')[-1])
+    suffix = os.path.splitext(filename)[1].lower()
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(content)
+    try:
+        return describe_attachment(f.name, pages=pages)
+    finally:
+        os.remove(f.name)
+
+def enqueue_job(data):
+    kind = data.get("kind")
+    if kind == "chat":
+        return jobs.submit(kind, generate_reply, data.get("message", "").strip(),
+                           data.get("session_id"), priority=INTERACTIVE)
+    if kind == "command":
+        return jobs.submit(kind, router.handle, data.get("message", "").strip(), priority=NORMAL)
+    if kind == "attachment":
+        return jobs.submit(kind, describe_upload, data.get("filename", ""), data.get("file", ""),
+                           data.get("pages"), priority=BACKGROUND)
+    return None
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Accoda un lavoro e risponde subito con il suo id"""
+    try:
+        job = enqueue_job(request.get_json())
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    if job is None:
+        return jsonify({"error": "Tipo di lavoro sconosciuto (chat, command, attachment)"}), 400
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Lavoro non trovato"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """SSE: lo stato attuale, poi un evento al termine del lavoro"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Lavoro non trovato"}), 404
+
+    def events():
+        if not job.wait(0):
+            yield sse_event(job.to_dict())
+            while not job.wait(JOB_HEARTBEAT):
+                yield ": in corso\n\n"
+        yield sse_event(job.to_dict())
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- ANALISI DI PIÙ ALLEGATI ---
+MAX_BATCH_FILES = 200
+# Ogni lotto usa un thread per core più il pool di processi: oltre questo limite si risponde 503
+MAX_CONCURRENT_BATCHES = 2
+batch_slots = threading.BoundedSemaphore(MAX_CONCURRENT_BATCHES)
+
+def save_batch(directory):
+    """Scrive gli allegati della richiesta (multipart "files" o JSON in base64) nella cartella.
+    Restituisce (nomi originali, percorsi, intervallo di pagine dei PDF)"""
+    names, paths = [], []
+
+    def target(index, filename):
+        # Prefisso numerico: file con lo stesso nome non si sovrascrivono
+        path = os.path.join(directory, f"{index}{os.path.splitext(filename)[1].lower()}")
+        names.append(filename)
+        paths.append(path)
+        return path
+
+    uploads = request.files.getlist("files")
+    if uploads:
+        for index, upload in enumerate(uploads[:MAX_BATCH_FILES]):
+            upload.save(target(index, upload.filename or ""))
+        pages = request.form.get("pages")
+        pages = json.loads(pages) if pages else None
+    else:
+        data = request.get_json(silent=True) or {}
+        for index, item in enumerate(data.get("files", [])[:MAX_BATCH_FILES]):
+            with open(target(index, item.get("filename", "")), "wb") as f:
+                f.write(base64.b64decode(item.get("file", "").split(',')[-1]))
+        pages = data.get("pages")
+    return names, paths, pages
+
+@app.route('/attachments', methods=['POST'])
+def describe_batch():
+    """Analizza più allegati in parallelo: un evento SSE per file, nell'ordine in cui sono pronti"""
+    from vision import describe_attachments
+
+    if not batch_slots.acquire(blocking=False):
+        return jsonify({"error": "Troppe analisi di allegati in corso, riprova tra poco"}), 503
+
+    directory = tempfile.mkdtemp(prefix="arcadia_")
+    def release():
+        shutil.rmtree(directory, ignore_errors=True)
+        batch_slots.release()
+
+    try:
+        names, paths, pages = save_batch(directory)
+    except Exception as e:
+        release()
+        return jsonify({"error": f"Allegati non validi: {e}"}), 400
+    if not paths:
+        release()
+        return jsonify({"error": "Nessun allegato"}), 400
+
+    def events():
+        for index, description in describe_attachments(paths, pages=pages):
+            yield sse_event({"index": index, "filename": names[index], "description": description})
+        yield sse_event({"done": True, "count": len(paths)})
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Alla chiusura della risposta, anche se il client si disconnette prima del primo evento
+    response.call_on_close(release)
+    return response
+
+# --- SERVER PERSISTENTE NEL PROCESSO ---
+server = None
+server_lock = threading.Lock()
+
+def server_status(url=SERVER_URL, timeout=0.5):
+    """Restituisce lo stato di /health, o None se nessun server risponde"""
+    try:
+        with urllib.request.urlopen(f"{url}/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+def start_server(host=SERVER_HOST, port=SERVER_PORT):
+    """Avvia il server in un thread del processo corrente; le chiamate successive lo riusano"""
+    global server
+    with server_lock:
+        if server is None:
+            from werkzeug.serving import make_server
+            server = make_server(host, port, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            threading.Thread(target=load_models, daemon=True).start()
+            print(f"✅ Server avviato su http://localhost:{port}")
+    return server
 
 if __name__ == '__main__':
-    app.run(port=5000, debug=False, use_reloader=False)
+    parser = argparse.ArgumentParser(description="Server di ArcadiaAI")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--model", choices=list(MODEL_CONFIGS), help="Variante di Phi-3 da usare al posto di quella del config")
+    parser.add_argument("--no-cache", action="store_true", help="Disattiva la cache delle risposte")
+    parser.add_argument("--no-prepacking", action="store_true",
+                        help="Disattiva il prepacking dei pesi di ONNX Runtime (meno RAM, di solito meno token/s)")
+    parser.add_argument("--trace", action="store_true", help="Traccia tutte le richieste (span nel log)")
+    args = parser.parse_args()
+    model_override = args.model
+    response_cache_enabled = not args.no_cache
+    disable_prepacking = args.no_prepacking
+    trace_all = args.trace
+
+    threading.Thread(target=load_models, daemon=True).start()
+    app.run(port=args.port, debug=False, use_reloader=False)
@@ -0,0 +1,228 @@
+# app_index.py
+# Indice delle app installate per @apri: costruito una volta, salvato su disco e aggiornato
+# solo con i pacchetti cambiati. La ricerca usa un dizionario per i nomi esatti, una lista
+# ordinata per i prefissi e un indice di trigrammi per tollerare errori di battitura.
+
+import os
+import json
+import time
+import bisect
+import threading
+
+CHECK_INTERVAL = 60            # Secondi tra due controlli dei pacchetti cambiati
+FULL_REFRESH_INTERVAL = 86400  # Ricostruzione completa periodica, anche con le modifiche disponibili
+MIN_SIMILARITY = 0.3
+
+
+def normalize_name(name):
+    return " ".join(str(name).lower().split())
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def is_user_app(package_name):
+    """Esclude le app di sistema non apribili"""
+    return "android" not in package_name and not package_name.startswith("com.android.")
+
+
+class AndroidPackageSource:
+    """Pacchetti dal PackageManager di Android (pyjnius)"""
+
+    def __init__(self):
+        from jnius import autoclass
+        activity = autoclass('org.kivy.android.PythonActivity').mActivity
+        self.pm = activity.getPackageManager()
+        self.resolver = activity.getContentResolver()
+        self.settings = autoclass('android.provider.Settings$Global')
+
+    def boot_count(self):
+        """Numero di avvii del dispositivo (API 24+); None se non disponibile"""
+        try:
+            return self.settings.getInt(self.resolver, self.settings.BOOT_COUNT)
+        except Exception:
+            return None
+
+    def list_packages(self):
+        """Scansione completa: {pacchetto: nome}"""
+        from jnius import cast
+        apps = {}
+        for package_info in self.pm.getInstalledPackages(0):
+            package_info = cast('android.content.pm.PackageInfo', package_info)
+            if is_user_app(package_info.packageName):
+                apps[package_info.packageName] = package_info.applicationInfo.loadLabel(self.pm).toString()
+        return apps
+
+    def changed_packages(self, sequence):
+        """(nuovo numero di sequenza, pacchetti installati/aggiornati/rimossi); None se non supportato"""
+        try:
+            changed = self.pm.getChangedPackages(sequence)  # API 26+
+        except Exception:
+            return None
+        if changed is None:
+            return sequence, []
+        return changed.getSequenceNumber(), list(changed.getPackageNames().toArray())
+
+    def label(self, package_name):
+        """Nome dell'app, None se non è più installata"""
+        try:
+            info = self.pm.getApplicationInfo(package_name, 0)
+        except Exception:
+            return None
+        return info.loadLabel(self.pm).toString() if is_user_app(package_name) else None
+
+
+class AppIndex:
+    """Indice persistente {pacchetto: nome} con ricerca esatta, per prefisso e approssimata"""
+
+    def __init__(self, source_factory, path=None):
+        self.source_factory = source_factory
+        self.source = None
+        self.path = path
+        self.lock = threading.RLock()
+        self.apps = {}
+        self.sequence = 0
+        self.boot_count = None  # Avvio a cui si riferisce la sequenza
+        self.last_check = 0.0
+        self.last_full_refresh = 0.0
+        self.load()
+
+    # --- Indici in memoria ---
+    def rebuild(self):
+        self.by_name = {}
+        self.postings = {}
+        for package_name, name in self.apps.items():
+            self.by_name.setdefault(name, package_name)
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, set()).add(package_name)
+        self.sorted_names = sorted(self.by_name)
+
+    def set_app(self, package_name, name):
+        if name is None:
+            self.apps.pop(package_name, None)
+        else:
+            self.apps[package_name] = normalize_name(name)
+
+    # --- Aggiornamento ---
+    def get_source(self):
+        if self.source is None:
+            self.source = self.source_factory()
+        return self.source
+
+    def refresh(self, full=False):
+        """Aggiorna l'indice: solo i pacchetti cambiati se possibile, altrimenti scansione completa"""
+        with self.lock:
+            source = self.get_source()
+            boot_count = source.boot_count()
+            stale = time.time() - self.last_full_refresh > FULL_REFRESH_INTERVAL
+            # La sequenza di getChangedPackages riparte da 0 a ogni riavvio
+            rebooted = boot_count is not None and boot_count != self.boot_count
+            full = full or stale or rebooted or not self.apps
+
+            changes = None if full else source.changed_packages(self.sequence)
+            if changes is not None and changes[0] < self.sequence:
+                # Sequenza tornata indietro: riavvio non segnalato dal contatore
+                changes, full = None, True
+
+            if full:
+                self.apps = {}
+                for package_name, name in source.list_packages().items():
+                    self.set_app(package_name, name)
+                # Riparte dalla sequenza attuale per i controlli successivi
+                current = source.changed_packages(0)
+                self.sequence = current[0] if current else 0
+                self.boot_count = boot_count
+                self.last_full_refresh = time.time()
+            self.last_check = time.time()
+            packages = []
+            if not full and changes is not None:
+                self.sequence, packages = changes
+                for package_name in packages:
+                    self.set_app(package_name, source.label(package_name))
+            # Nessuna modifica: niente trigrammi da ricostruire né file da riscrivere
+            if full or packages:
+                self.rebuild()
+                self.save()
+
+    def ensure_fresh(self):
+        """Aggiorna se è passato CHECK_INTERVAL dall'ultimo controllo; True se ha aggiornato"""
+        if not self.apps or time.time() - self.last_check > CHECK_INTERVAL:
+            self.refresh()
+            return True
+        return False
+
+    # --- Ricerca ---
+    def find(self, query, refresh=True):
+        """Restituisce {'name', 'package'} dell'app più simile, o None"""
+        query = normalize_name(query)
+        if not query:
+            return None
+        refreshed = self.ensure_fresh() if refresh else False
+
+        with self.lock:
+            match = self.lookup(query)
+        if match is None and refresh and not refreshed:
+            # Forse è un'app appena installata
+            self.refresh()
+            with self.lock:
+                match = self.lookup(query)
+        return match
+
+    def lookup(self, query):
+        if query in self.by_name:
+            return {"name": query, "package": self.by_name[query]}
+
+        # Prefisso: ricerca binaria sui nomi ordinati
+        i = bisect.bisect_left(self.sorted_names, query)
+        if i < len(self.sorted_names) and self.sorted_names[i].startswith(query):
+            name = self.sorted_names[i]
+            return {"name": name, "package": self.by_name[name]}
+
+        # Trigrammi: solo le app che condividono almeno un trigramma con la richiesta
+        query_grams = trigrams(query)
+        scores = {}
+        for gram in query_grams:
+            for package_name in self.postings.get(gram, ()):
+                scores[package_name] = scores.get(package_name, 0) + 1
+
+        best, best_score = None, MIN_SIMILARITY
+        for package_name, common in scores.items():
+            name = self.apps[package_name]
+            if query in name or (len(name) >= 3 and name in query):
+                score = 1.0
+            else:
+                score = common / len(query_grams | trigrams(name))
+            if score > best_score:
+                best, best_score = package_name, score
+        return {"name": self.apps[best], "package": best} if best else None
+
+    # --- Persistenza ---
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.apps = data["apps"]
+                self.sequence = data.get("sequence", 0)
+                self.boot_count = data.get("boot_count")
+                self.last_full_refresh = data.get("last_full_refresh", 0.0)
+            except Exception as e:
+                print(f"⚠️ Indice app illeggibile: {e}")
+                self.apps = {}
+        self.rebuild()
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "apps": self.apps,
+                    "sequence": self.sequence,
+                    "boot_count": self.boot_count,
+                    "last_full_refresh": self.last_full_refresh
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"❌ Errore salvataggio indice app: {e}")
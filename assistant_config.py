@@ -0,0 +1,92 @@
+# assistant_config.py
+# Configurazione condivisa tra launcher Kivy (main.py) e server Flask (app.py)
+# Nessuna dipendenza da Kivy: può essere importato anche dal backend
+
+import json
+from pathlib import Path
+
+# --- PERCORSI ---
+BASE_DIR = Path(__file__).parent
+CONFIG_FILE = BASE_DIR / "user_config.json"
+
+DEFAULT_CONFIG = {
+    "model_version": "balanced",
+    "use_cloud": False,
+    "wake_word_enabled": True,
+    "tts_engine": "auto"  # auto (gTTS, poi offline) | gtts | offline
+}
+
+def load_config():
+    if CONFIG_FILE.exists():
+        try:
+            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            pass
+    return DEFAULT_CONFIG.copy()
+
+def save_config(config):
+    try:
+        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        return True
+    except Exception as e:
+        print(f"❌ Errore salvataggio: {e}")
+        return False
+
+# --- IDENTITÀ ---
+CES_IDENTITY = {
+    "name": "ArcadiaAI Assistant",
+    "creator": "Mirko Yuri Donato",
+    "version": "3.5",
+    "model": "Phi-3-mini (simulato)",
+    "license": "MPL 2.0",
+    "repository": "https://github.com/Mirko-linux/ArcadiaAI-Assistant"
+}
+
+# --- COMANDI SAC ---
+SAC_COMMANDS = {
+    "aiuto": "Mostra i comandi",
+    "info": "Informazioni su ArcadiaAI",
+    "cerca [query]": "Cerca su web",
+    "immagine [descrizione]": "Genera un'immagine",
+    "mappe [luogo]": "Mostra una mappa",
+    "app [nome]": "Cerca un'app",
+    "data": "Mostra data e ora",
+    "codice_sorgente": "Link al codice sorgente",
+    "telegraph [testo]": "Pubblica su Telegraph",
+    "telegram [link] [testo]": "Invia a un canale Telegram",
+    "esporta": "Esporta la chat",
+    "scarica [completa|bilanciata|leggera]": "Scarica un modello Phi-3"
+}
+
+# --- PROMPT DI SISTEMA ---
+def build_system_prompt():
+    """Istruzioni fisse all'inizio di ogni conversazione (identità e comandi SAC)"""
+    commands = "\n".join(f"- @{cmd}: {desc}" for cmd, desc in SAC_COMMANDS.items())
+    return (
+        f"Sei {CES_IDENTITY['name']} v{CES_IDENTITY['version']}, un assistente virtuale creato da "
+        f"{CES_IDENTITY['creator']} e distribuito con licenza {CES_IDENTITY['license']}. "
+        "Funzioni in locale, senza tracciamento. Rispondi in italiano, in modo chiaro e conciso.\n"
+        "L'utente può usare questi comandi:\n"
+        f"{commands}"
+    )
+
+# --- MODELLI PHI-3 ---
+MODEL_CONFIGS = {
+    "full": {
+        "url": "https://huggingface.co/microsoft/Phi-3-mini-4K-instruct-onnx/resolve/main/cpu-and-gpu-fp16/model.onnx",
+        "path": "assets/models/phi3-full.onnx",
+        "description": "Alta qualità, richiede 4GB+ RAM"
+    },
+    "balanced": {
+        "url": "https://huggingface.co/microsoft/Phi-3-mini-4K-instruct-onnx/resolve/main/cpu-int4-rtn-block-128/model.onnx",
+        "path": "assets/models/phi3-balanced.onnx",
+        "description": "Qualità e velocità bilanciate"
+    },
+    "light": {
+        "url": "https://huggingface.co/microsoft/Phi-3-mini-4K-instruct-onnx/resolve/main/cpu-int4-rtn-block-32/model.onnx",
+        "path": "assets/models/phi3-light.onnx",
+        "description": "Leggera, per dispositivi con poca RAM"
+    }
+}
@@ -0,0 +1,401 @@
+# benchmark_api.py
+# Benchmark end-to-end dell'API di app.py: /chat (in streaming) e /transcribe con carichi
+# sintetici a concorrenza configurabile. Per ogni variante di MODEL_CONFIGS avvia un server
+# dedicato e misura latenza (p50/p95/p99), throughput, tempo al primo token e RSS di picco;
+# i risultati in JSON si confrontano tra un commit e l'altro con --compare.
+#
+#   python benchmark_api.py                                  # varianti installate, concorrenza 1 e 4
+#   python benchmark_api.py --variants light --concurrency 1 2 8 --requests 40
+#   python benchmark_api.py --wav registrazioni/ --prompts domande.txt --json dopo.json
+#   python benchmark_api.py --json dopo.json --compare prima.json
+#   python benchmark_api.py --url http://localhost:5000 --pid 1234   # server già avviato
+
+import io
+import sys
+import json
+import math
+import time
+import wave
+import array
+import base64
+import argparse
+import platform
+import threading
+import subprocess
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from assistant_config import BASE_DIR, MODEL_CONFIGS
+from downloader import is_complete
+
+PORT = 5077                # Diversa da quella dell'assistente, che può restare acceso
+READY_TIMEOUT = 600        # Secondi concessi al caricamento dei modelli
+REQUEST_TIMEOUT = 300
+CONCURRENCY = [1, 4]
+REQUESTS = 20              # Richieste misurate per ogni livello di concorrenza
+WARMUP = 2                 # Richieste iniziali escluse dalle misure
+RSS_INTERVAL = 0.1
+SAMPLE_RATE = 16000
+
+DEFAULT_PROMPTS = [
+    "Ciao, come stai?",
+    "Che cos'è la fotosintesi?",
+    "Scrivi una breve poesia sul mare.",
+    "Spiegami la differenza tra RAM e memoria di archiviazione.",
+    "Dammi tre consigli per dormire meglio.",
+    "Come si prepara il risotto alla milanese?",
+    "Riassumi in due frasi la storia dell'Impero romano.",
+    "Quali sono i pianeti del sistema solare?"
+]
+
+# --- CARICHI ---
+def load_prompts(path=None):
+    """Un prompt per riga (le righe vuote e quelle che iniziano con # sono ignorate)"""
+    if not path:
+        return DEFAULT_PROMPTS
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def synthetic_wav(seconds=3.0, sample_rate=SAMPLE_RATE):
+    """WAV di riserva senza registrazioni: toni modulati simili a sillabe, per misurare la decodifica"""
+    samples = array.array("h")
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        envelope = max(0.0, math.sin(2 * math.pi * 3 * t))  # ~6 "sillabe" al secondo
+        samples.append(int(8000 * envelope * math.sin(2 * math.pi * (180 + 60 * math.sin(t)) * t)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def wav_duration(data):
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+def load_wavs(paths):
+    """Registrazioni WAV (file o cartelle); senza, un singolo WAV sintetico"""
+    files = []
+    for path in map(Path, paths or []):
+        files.extend(sorted(path.glob("*.wav")) if path.is_dir() else [path])
+    fixtures = [{"name": f.name, "data": f.read_bytes()} for f in files]
+    if not fixtures:
+        fixtures = [{"name": "sintetico", "data": synthetic_wav()}]
+    for fixture in fixtures:
+        fixture["seconds"] = wav_duration(fixture["data"])
+        fixture["audio"] = "data:audio/wav;base64," + base64.b64encode(fixture["data"]).decode("ascii")
+    return fixtures
+
+# --- RICHIESTE ---
+def post(url, payload, headers=None):
+    body = json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json", **(headers or {})})
+    return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+
+def chat_request(url, prompt):
+    """Una risposta in streaming: latenza totale, tempo al primo token e frammenti ricevuti"""
+    start = time.perf_counter()
+    first_token = None
+    tokens = 0
+    with post(f"{url}/chat", {"message": prompt, "stream": True}, {"Accept": "text/event-stream"}) as response:
+        for line in response:
+            if not line.startswith(b"data: "):
+                continue
+            event = json.loads(line[6:])
+            if event.get("token"):
+                first_token = first_token or time.perf_counter()
+                tokens += 1
+    end = time.perf_counter()
+    return {"latency": end - start, "ttft": (first_token or end) - start, "tokens": tokens}
+
+def transcribe_request(url, fixture):
+    """Una trascrizione: latenza e fattore tempo reale (tempo di decodifica / durata dell'audio)"""
+    start = time.perf_counter()
+    with post(f"{url}/transcribe", {"audio": fixture["audio"]}) as response:
+        result = json.loads(response.read())
+    latency = time.perf_counter() - start
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return {"latency": latency, "rtf": latency / fixture["seconds"]}
+
+def health(url, timeout=1):
+    try:
+        with urllib.request.urlopen(f"{url}/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+# --- STATISTICHE ---
+def percentile(values, q):
+    """Percentile con interpolazione lineare tra i due campioni più vicini"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(values, scale=1000):
+    """p50/p95/p99, media, minimo e massimo (in ms con scale=1000)"""
+    if not values:
+        return None
+    summary = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+    summary.update(mean=sum(values) / len(values), min=min(values), max=max(values))
+    return {name: round(value * scale, 3) for name, value in summary.items()}
+
+def run_load(request, items, concurrency, requests, warmup=WARMUP):
+    """Esegue le richieste con `concurrency` client in parallelo; restituisce misure, errori e durata"""
+    for i in range(warmup):
+        try:
+            request(items[i % len(items)])
+        except Exception:
+            pass
+
+    def attempt(i):
+        try:
+            return request(items[i % len(items)])
+        except Exception as e:
+            return {"error": str(e)}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(attempt, range(requests)))
+    wall = time.perf_counter() - start
+    errors = [s["error"] for s in samples if "error" in s]
+    return [s for s in samples if "error" not in s], errors, wall
+
+def chat_summary(samples, wall):
+    tokens = sum(s["tokens"] for s in samples)
+    return {
+        "latency_ms": summarize([s["latency"] for s in samples]),
+        "ttft_ms": summarize([s["ttft"] for s in samples]),
+        # Velocità di decodifica per richiesta: frammenti dopo il primo / tempo dopo il primo
+        "tokens_per_second": summarize([(s["tokens"] - 1) / (s["latency"] - s["ttft"])
+                                        for s in samples if s["tokens"] > 1 and s["latency"] > s["ttft"]], scale=1),
+        "throughput_tokens_per_second": round(tokens / wall, 3) if wall else None
+    }
+
+def transcribe_summary(samples, wall):
+    return {
+        "latency_ms": summarize([s["latency"] for s in samples]),
+        "real_time_factor": summarize([s["rtf"] for s in samples], scale=1)
+    }
+
+# --- MEMORIA ---
+def read_rss(pid):
+    """(RSS attuale, picco dal kernel) in byte; il picco è disponibile solo su Linux"""
+    try:
+        values = {}
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    values[line.split(":")[0]] = int(line.split()[1]) * 1024
+        return values.get("VmRSS"), values.get("VmHWM")
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss, None
+    except Exception:
+        return None, None
+
+class RssMonitor:
+    """Campiona la memoria del server durante il benchmark e ne conserva il massimo"""
+
+    def __init__(self, pid, interval=RSS_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.is_set():
+            rss, high_water = read_rss(self.pid)
+            self.peak = max(self.peak, rss or 0, high_water or 0)
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def peak_mb(self):
+        return round(self.peak / 2**20, 1) if self.peak else None
+
+class NullMonitor:
+    """Server esterno senza pid: la memoria non viene misurata"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def peak_mb(self):
+        return None
+
+# --- SERVER ---
+def launch_server(variant, port, log=None, no_prepacking=False):
+    """Server dedicato alla variante, senza cache delle risposte (ogni richiesta passa dal modello)"""
+    command = [sys.executable, "app.py", "--port", str(port), "--model", variant, "--no-cache"]
+    if no_prepacking:
+        command.append("--no-prepacking")
+    output = None if log else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=BASE_DIR, stdout=output, stderr=output)
+
+def wait_ready(url, process=None, timeout=READY_TIMEOUT):
+    """Attende che /health segnali i modelli pronti; restituisce (secondi, stato)"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Il server è terminato (codice {process.returncode})")
+        status = health(url)
+        if status and status.get("ready"):
+            return time.perf_counter() - start, status
+        time.sleep(0.5)
+    raise TimeoutError(f"Server non pronto entro {timeout} s")
+
+def benchmark_server(url, pid, args, prompts, fixtures):
+    """Tutti i carichi richiesti contro un server già pronto"""
+    status = health(url) or {}
+    results = []
+    with RssMonitor(pid) if pid else NullMonitor() as monitor:
+        for workload in args.workloads:
+            if workload == "chat" and not status.get("phi3"):
+                print("   ⚠️ Phi-3 non caricato: salto /chat")
+                continue
+            if workload == "transcribe" and not status.get("vosk"):
+                print("   ⚠️ Vosk non caricato: salto /transcribe")
+                continue
+            for concurrency in args.concurrency:
+                if workload == "chat":
+                    samples, errors, wall = run_load(lambda p: chat_request(url, p), prompts, concurrency, args.requests)
+                    summary = chat_summary(samples, wall)
+                else:
+                    samples, errors, wall = run_load(lambda f: transcribe_request(url, f), fixtures, concurrency, args.requests)
+                    summary = transcribe_summary(samples, wall)
+                result = {"workload": workload, "concurrency": concurrency, "requests": args.requests,
+                          "errors": len(errors), "throughput_rps": round(len(samples) / wall, 3), **summary}
+                results.append(result)
+                report(result, errors)
+    return status, results, monitor.peak_mb()
+
+def report(result, errors):
+    latency = result["latency_ms"] or {}
+    line = (f"   {result['workload']:<10} x{result['concurrency']:<3} "
+            f"p50 {latency.get('p50', 0):8.0f} ms  p95 {latency.get('p95', 0):8.0f} ms  "
+            f"p99 {latency.get('p99', 0):8.0f} ms  {result['throughput_rps']:6.2f} req/s")
+    if result.get("ttft_ms"):
+        line += f"  primo token p50 {result['ttft_ms']['p50']:.0f} ms"
+    if result.get("real_time_factor"):
+        line += f"  RTF p50 {result['real_time_factor']['p50']:.2f}"
+    print(line)
+    if errors:
+        print(f"   ❌ {len(errors)} errori, es.: {errors[0]}")
+
+# --- CONFRONTO ---
+def git_revision():
+    """Commit corrente (con '-dirty' se ci sono modifiche non salvate)"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, baseline):
+    """Differenze percentuali rispetto a un'esecuzione precedente (positivo = più lento)"""
+    previous = {(v["variant"], r["workload"], r["concurrency"]): r
+                for v in baseline["variants"] for r in v["results"]}
+    print(f"\n📊 Confronto con {baseline.get('commit')} (positivo = più lento)")
+    for variant in current["variants"]:
+        for result in variant["results"]:
+            old = previous.get((variant["variant"], result["workload"], result["concurrency"]))
+            if not old:
+                continue
+            deltas = []
+            for metric in ("latency_ms", "ttft_ms"):
+                for q in ("p50", "p95"):
+                    new_value = (result.get(metric) or {}).get(q)
+                    old_value = (old.get(metric) or {}).get(q)
+                    if new_value is not None and old_value:
+                        deltas.append(f"{metric[:-3]} {q} {100 * (new_value - old_value) / old_value:+.1f}%")
+            print(f"   {variant['variant']:<9} {result['workload']:<10} x{result['concurrency']:<3} {'  '.join(deltas)}")
+
+if __name__ == "__main__":
+    installed = [key for key, config in MODEL_CONFIGS.items() if is_complete(BASE_DIR / config["path"])]
+    parser = argparse.ArgumentParser(description="Benchmark di latenza dell'API di ArcadiaAI")
+    parser.add_argument("--variants", nargs="*", choices=list(MODEL_CONFIGS), default=installed,
+                        help="Varianti di Phi-3 da provare (predefinite: quelle installate)")
+    parser.add_argument("--workloads", nargs="*", choices=["chat", "transcribe"], default=["chat", "transcribe"])
+    parser.add_argument("--concurrency", nargs="*", type=int, default=CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--prompts", help="File di prompt, uno per riga")
+    parser.add_argument("--wav", nargs="*", help="Registrazioni WAV o cartelle che le contengono")
+    parser.add_argument("--url", help="Usa un server già avviato invece di avviarne uno per variante")
+    parser.add_argument("--pid", type=int, help="Pid del server indicato con --url (per la memoria)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-prepacking", action="store_true",
+                        help="Avvia i server senza prepacking dei pesi (da confrontare con --compare)")
+    parser.add_argument("--log", action="store_true", help="Mostra l'output dei server avviati")
+    parser.add_argument("--json", help="Salva i risultati in un file JSON")
+    parser.add_argument("--compare", help="JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.prompts)
+    fixtures = load_wavs(args.wav)
+    run = {
+        "commit": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"workloads": args.workloads, "concurrency": args.concurrency, "requests": args.requests,
+                     "prompts": len(prompts), "wav": [f["name"] for f in fixtures],
+                     "no_prepacking": args.no_prepacking},
+        "variants": []
+    }
+
+    if args.url:
+        print(f"\n⏱️ Server esistente {args.url}")
+        wait_ready(args.url)
+        status, results, peak = benchmark_server(args.url, args.pid, args, prompts, fixtures)
+        run["variants"].append({"variant": status.get("model"), "load_seconds": None,
+                                "peak_rss_mb": peak, "results": results})
+    elif not args.variants:
+        print("❌ Nessuna variante di Phi-3 installata (usa --variants o --url)")
+
+    for variant in [] if args.url else args.variants:
+        print(f"\n⏱️ Variante {variant}: avvio del server...")
+        url = f"http://localhost:{args.port}"
+        process = launch_server(variant, args.port, args.log, args.no_prepacking)
+        try:
+            load_seconds, _ = wait_ready(url, process)
+            print(f"   ✅ Modelli pronti in {load_seconds:.1f} s")
+            _, results, peak = benchmark_server(url, process.pid, args, prompts, fixtures)
+            print(f"   💾 RSS di picco: {peak} MB")
+            run["variants"].append({"variant": variant, "load_seconds": round(load_seconds, 3),
+                                    "peak_rss_mb": peak, "results": results})
+        except Exception as e:
+            print(f"   ❌ Benchmark di {variant} fallito: {e}")
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"\n💾 Risultati salvati in {args.json}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(run, json.load(f))
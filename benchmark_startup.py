@@ -0,0 +1,72 @@
+# benchmark_startup.py
+# Profilo dei tempi di import (python -X importtime) dei moduli dell'assistente:
+# mostra quali dipendenze pesano sull'avvio del launcher prima della prima schermata.
+#
+#   python benchmark_startup.py                   # profilo di main.py
+#   python benchmark_startup.py app commands      # altri moduli
+#   python benchmark_startup.py --json risultati.json
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+TOP = 15
+
+def profile_imports(module, python=sys.executable):
+    """Importa il modulo in un interprete pulito; restituisce (secondi totali, voci, errore)"""
+    start = time.perf_counter()
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BASE_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+
+    entries = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,  # Annidamento dell'import
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000
+        })
+
+    error = None
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+    return elapsed, entries, error
+
+def report(module, elapsed, entries, error, top=TOP):
+    total_ms = sum(e["cumulative_ms"] for e in entries if e["depth"] == 0)
+    print(f"\n📦 import {module}: {total_ms:.0f} ms di import, {elapsed * 1000:.0f} ms con l'avvio dell'interprete")
+    if error:
+        print(f"   ❌ Import fallito: {error}")
+
+    print("   Import diretti più lenti (cumulativo):")
+    for e in sorted((e for e in entries if e["depth"] <= 1), key=lambda e: -e["cumulative_ms"])[:top]:
+        print(f"   {e['cumulative_ms']:9.1f} ms  {'  ' * e['depth']}{e['module']}")
+
+    print("   Moduli più lenti (tempo proprio):")
+    for e in sorted(entries, key=lambda e: -e["self_ms"])[:top]:
+        print(f"   {e['self_ms']:9.1f} ms  {e['module']}")
+
+    return {"module": module, "import_ms": total_ms, "wall_ms": elapsed * 1000,
+            "error": error, "entries": entries}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempi di import dei moduli di ArcadiaAI")
+    parser.add_argument("modules", nargs="*", default=["main"])
+    parser.add_argument("--top", type=int, default=TOP)
+    parser.add_argument("--json", help="Salva i risultati in un file JSON")
+    args = parser.parse_args()
+
+    results = [report(module, *profile_imports(module), top=args.top) for module in args.modules]
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Risultati salvati in {args.json}")
@@ -0,0 +1,203 @@
+# commands.py
+# Comandi SAC (@aiuto, @cerca, ...): ogni handler si registra nel router con lo schema
+# del proprio argomento, e la dispatch è una singola ricerca nel dizionario dei comandi.
+# Non dipende da Kivy: lo usano sia il launcher (main.py) sia il server (app.py).
+
+import threading
+from collections import deque
+from datetime import datetime
+
+from assistant_config import CES_IDENTITY, MODEL_CONFIGS, SAC_COMMANDS, load_config, save_config
+from web_client import WebClient, WebError
+
+try:
+    from duckduckgo_search import ddg
+except ImportError:
+    ddg = None
+
+# --- PAROLE BANNATE (anti-abuso) ---
+PAROLE_BANNATE = []
+
+# --- BACKEND CES-IMAGE ---
+CES_IMAGE_API = "https://arcadiaai.onrender.com/api/ces-image"
+
+MODEL_VARIANTS = {"completa": "full", "bilanciata": "balanced", "leggera": "light"}
+
+# Client condiviso per @cerca e @immagine (connessioni riusate, cache dei risultati)
+web = WebClient()
+
+
+class BannedWords:
+    """Automa di Aho-Corasick: trova tutte le parole bannate con una sola scansione del testo"""
+
+    def __init__(self, words):
+        self.goto = [{}]    # Transizioni per stato
+        self.fail = [0]     # Stato di ripiego quando manca una transizione
+        self.output = [False]
+
+        for word in words:
+            state = 0
+            for char in word.lower():
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(False)
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            if word:
+                self.output[state] = True
+
+        # Link di fallimento, calcolati in ampiezza (gli stati di profondità 1 ripiegano sulla radice)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                if state:
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] or self.output[self.fail[child]]
+
+    def contains(self, text):
+        state = 0
+        for char in text.lower():
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                return True
+        return False
+
+
+class Command:
+    def __init__(self, name, handler, argument=None, required=False):
+        self.name = name
+        self.handler = handler
+        self.argument = argument    # Nome dell'argomento (None = nessun argomento)
+        self.required = required
+
+    @property
+    def usage(self):
+        return f"@{self.name} [{self.argument}]" if self.argument else f"@{self.name}"
+
+
+class CommandRouter:
+    """Registro dei comandi SAC"""
+
+    def __init__(self):
+        self.commands = {}
+        self.backend = {}  # Funzioni del server (cambio modello, download), fornite da app.py
+
+    def bind(self, **functions):
+        """Collega i comandi al server in esecuzione, senza importare app.py
+        (avviato come script sarebbe __main__, e l'import ne caricherebbe una seconda copia)"""
+        self.backend.update(functions)
+
+    def register(self, name, *aliases, argument=None, required=False):
+        """Decoratore: registra l'handler sotto il nome del comando e i suoi alias"""
+        def decorator(handler):
+            command = Command(name, handler, argument, required)
+            for key in (name,) + aliases:
+                self.commands[key] = command
+            return handler
+        return decorator
+
+    def dispatch(self, name, argument=""):
+        command = self.commands.get(name.lower().strip())
+        if command is None:
+            return "❌ Comando non riconosciuto. Usa `@aiuto`."
+        argument = argument.strip()
+        if command.required and not argument:
+            return f"❌ Usa: `{command.usage}`"
+        return command.handler(argument)
+
+    def handle(self, message):
+        """Esegue un messaggio "@comando argomento"; None se non è un comando"""
+        if not message.startswith("@"):
+            return None
+        name, _, argument = message[1:].partition(" ")
+        return self.dispatch(name, argument)
+
+
+router = CommandRouter()
+banned_words = BannedWords(PAROLE_BANNATE)
+
+def handle_sac_command(command, argument=""):
+    return router.dispatch(command, argument)
+
+def apply_model_version():
+    """Carica a caldo la variante appena salvata nel config (in background);
+    senza server attivo la scelta vale al prossimo caricamento del modello"""
+    swap_model = router.backend.get("swap_model")
+    if swap_model:
+        threading.Thread(target=swap_model, daemon=True).start()
+
+
+# --- HANDLER ---
+@router.register("aiuto")
+def command_help(argument):
+    return "[b]🎯 Comandi disponibili:[/b]\n" + "\n".join([f"- [i]@{cmd}[/i] → {desc}" for cmd, desc in SAC_COMMANDS.items()])
+
+@router.register("info")
+def command_info(argument):
+    return f"[b]ℹ️ {CES_IDENTITY['name']} v{CES_IDENTITY['version']}[/b]\n• Creatore: {CES_IDENTITY['creator']}\n• Modello: {CES_IDENTITY['model']}\n• [ref={CES_IDENTITY['repository']}][color=0000ff]Codice sorgente[/color][/ref]"
+
+@router.register("data")
+def command_date(argument):
+    return f"📅 Oggi è {datetime.now().strftime('%d/%m/%Y, %H:%M')}"
+
+@router.register("modello", argument="completa|bilanciata|leggera|automatica")
+def command_model(argument):
+    config = load_config()
+    if not argument:
+        current = config.get("model_version", "balanced")
+        return (
+            f"🔧 **Modello attuale**: {current}\n\n"
+            "Disponibili:\n"
+            "• `@modello completa`\n"
+            "• `@modello bilanciata`\n"
+            "• `@modello leggera`\n"
+            "• `@modello automatica` (scelta in base a RAM e velocità)\n\n"
+            "Usa `@scarica` per scaricare il modello scelto."
+        )
+    elif argument in MODEL_VARIANTS or argument == "automatica":
+        config["model_version"] = MODEL_VARIANTS.get(argument, "auto")
+        save_config(config)
+        apply_model_version()
+        return f"✅ Modello impostato su **{argument}**, applicato senza riavvio."
+    else:
+        return "❌ Usa: `@modello [completa|bilanciata|leggera|automatica]`"
+
+@router.register("scarica", argument="completa|bilanciata|leggera")
+def command_download(argument):
+    model_key = MODEL_VARIANTS.get(argument, load_config().get("model_version", "balanced"))
+    if model_key not in MODEL_CONFIGS:
+        return "❌ Usa: `@scarica [completa|bilanciata|leggera]`"
+    start_download = router.backend.get("start_download")
+    if start_download is None:
+        return "❌ Server non avviato: impossibile scaricare il modello."
+    if not start_download(model_key):
+        return "⏳ Un download è già in corso."
+    return f"⬇️ Download del modello **{model_key}** avviato ({MODEL_CONFIGS[model_key]['description']})."
+
+@router.register("cerca", argument="query", required=True)
+def command_search(argument):
+    try:
+        results = web.search(ddg, argument, max_results=3)
+        return "\n".join([f"[ref={r['href']}][color=0000ff][u]{r['title']}[/u][/color][/ref]" for r in results])
+    except:
+        return "❌ Ricerca fallita."
+
+@router.register("immagine", argument="descrizione", required=True)
+def command_image(argument):
+    if banned_words.contains(argument):
+        return "❌ Questo prompt non è consentito."
+    try:
+        data = web.post_json(CES_IMAGE_API, {"prompt": argument})
+        return "__IMAGE__:" + data.get("image_url") if data.get("image_url") else "⚠️ Nessuna immagine."
+    except WebError as e:
+        return f"❌ Errore API: {e.status}"
+    except Exception as e:
+        return f"❌ Errore: {e}"
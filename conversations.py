@@ -0,0 +1,135 @@
+# conversations.py
+# Conversazioni a più turni lato server: per ogni sessione si conservano i token
+# della cronologia e la relativa KV-cache, così ogni richiesta elabora solo il nuovo turno.
+
+import time
+import threading
+from collections import OrderedDict
+
+from phi3_engine import format_prompt
+
+# Ogni token in cache occupa centinaia di KB (32 layer x chiavi/valori):
+# poche sessioni attive alla volta, le altre vengono scartate
+MAX_SESSIONS = 4
+SESSION_TTL = 30 * 60
+
+# Quando la cronologia sfora il contesto si scende a questa frazione,
+# così il prefill completo dopo il taglio non si ripete a ogni turno
+WINDOW_LOW_WATER = 0.5
+
+END_OF_TURN = "<|end|>\n"
+
+
+class Conversation:
+    """Cronologia tokenizzata di una sessione e KV-cache corrispondente"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.cache = engine.start_cache()
+        self.prefix_len = len(self.cache)
+        self.token_ids = list(self.cache.token_ids)
+        self.turn_starts = []  # Indice del primo token di ogni turno utente
+        self.last_used = time.time()
+        self.end_ids = engine.encode(END_OF_TURN, add_special_tokens=False)
+
+    def is_empty(self):
+        return not self.turn_starts
+
+    def append_user(self, message):
+        ids = self.engine.encode(format_prompt(message), add_special_tokens=not self.token_ids)
+        self.turn_starts.append(len(self.token_ids))
+        self.token_ids += ids
+
+    def append_reply(self, output_ids):
+        self.token_ids += list(output_ids) + self.end_ids
+
+    def record_turn(self, message, reply):
+        """Aggiunge un turno già noto (es. dalla cache risposte); i token verranno elaborati al turno successivo"""
+        with self.lock:
+            self.append_user(message)
+            self.append_reply(self.engine.encode(reply, add_special_tokens=False))
+            self.last_used = time.time()
+
+    def fit(self, max_new_tokens):
+        """Finestra scorrevole: scarta i turni più vecchi se la cronologia non sta nel contesto"""
+        limit = self.engine.max_context - max_new_tokens
+        if len(self.token_ids) <= limit or len(self.turn_starts) < 2:
+            return
+
+        target = self.prefix_len + int((limit - self.prefix_len) * WINDOW_LOW_WATER)
+        keep = len(self.turn_starts) - 1  # L'ultimo turno (quello nuovo) resta sempre
+        for i in range(1, len(self.turn_starts)):
+            if len(self.token_ids) - self.turn_starts[i] + self.prefix_len <= target:
+                keep = i
+                break
+
+        cut = self.turn_starts[keep]
+        shift = cut - self.prefix_len
+        self.token_ids = self.token_ids[:self.prefix_len] + self.token_ids[cut:]
+        self.turn_starts = [start - shift for start in self.turn_starts[keep:]]
+        # Le posizioni sono cambiate: si riparte dalla cache del prompt di sistema
+        self.cache = self.engine.start_cache()
+
+    def stream(self, message, max_new_tokens=256, on_start=None, **sampling):
+        """Genera la risposta al nuovo turno elaborando solo i token non ancora in cache;
+        on_start(generation) riceve la Generation appena creata (es. per contarne i token)"""
+        with self.lock:
+            self.append_user(message)
+            self.fit(max_new_tokens)
+
+            cached = len(self.cache)
+            if self.cache.token_ids != self.token_ids[:cached]:
+                self.cache = self.engine.start_cache()
+                cached = len(self.cache)
+
+            generation = self.engine.generate(self.token_ids[cached:], cache=self.cache,
+                                              max_new_tokens=max_new_tokens, **sampling)
+            if on_start:
+                on_start(generation)
+            try:
+                yield from generation
+            finally:
+                # Anche se interrotta, la risposta parziale entra nella cronologia
+                self.cache = generation.cache
+                self.append_reply(generation.output_ids)
+                self.last_used = time.time()
+
+
+class ConversationStore:
+    """Conversazioni attive per id di sessione, con scadenza ed espulsione LRU"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id, engine):
+        with self.lock:
+            now = time.time()
+            for sid in [s for s, c in self.sessions.items() if now - c.last_used > self.ttl]:
+                del self.sessions[sid]
+
+            conversation = self.sessions.get(session_id)
+            # Un cambio di modello invalida cronologia tokenizzata e cache
+            if conversation is None or conversation.engine is not engine:
+                conversation = Conversation(engine)
+                self.sessions[session_id] = conversation
+            self.sessions.move_to_end(session_id)
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return conversation
+
+    def reset(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def clear(self):
+        """Scarta tutte le sessioni: ognuna tiene in vita il motore e la sua KV-cache"""
+        with self.lock:
+            self.sessions.clear()
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,201 @@
+# downloader.py
+# Download dei modelli (MODEL_CONFIGS) a blocchi paralleli con richieste HTTP Range.
+# Il file finale viene preallocato e scritto tramite mmap; lo stato dei blocchi completati
+# è salvato accanto al file, così un download interrotto riprende da dove si era fermato.
+
+import os
+import re
+import json
+import mmap
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 16 * 1024 * 1024   # Byte per richiesta Range
+BLOCK_SIZE = 1024 * 1024        # Byte letti dalla rete per volta
+WORKERS = 4
+TIMEOUT = 30
+
+
+class DownloadError(Exception):
+    """Download non riuscito o file corrotto"""
+
+
+def state_path(path):
+    return f"{path}.download.json"
+
+def is_complete(path):
+    """Il file esiste e non ha un download in sospeso (né lui né i suoi pesi esterni .data)"""
+    return (os.path.exists(path) and not os.path.exists(state_path(path))
+            and not os.path.exists(state_path(f"{path}.data")))
+
+
+class _RecordingRedirect(urllib.request.HTTPRedirectHandler):
+    """Conserva gli header di ogni salto: Hugging Face mette lo SHA-256 in X-Linked-Etag prima del redirect"""
+
+    def __init__(self):
+        self.headers = []
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.headers.append(headers)
+        new_request = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_request is not None:
+            new_request.method = req.get_method()  # Una HEAD resta una HEAD
+        return new_request
+
+def probe(url, timeout=TIMEOUT):
+    """HEAD sul file: (url finale, dimensione, supporto Range, sha256 annunciato dal server)"""
+    recorder = _RecordingRedirect()
+    opener = urllib.request.build_opener(recorder)
+    with opener.open(urllib.request.Request(url, method="HEAD"), timeout=timeout) as response:
+        headers = recorder.headers + [response.headers]
+        final_url = response.geturl()
+
+    linked_size = next((h["X-Linked-Size"] for h in headers if h.get("X-Linked-Size")), None)
+    size = int(linked_size or headers[-1].get("Content-Length") or 0) or None
+    accepts_ranges = headers[-1].get("Accept-Ranges", "").lower() == "bytes"
+
+    sha256 = None
+    for h in headers:
+        for name in ("X-Linked-Etag", "ETag"):
+            etag = (h.get(name) or "").removeprefix("W/").strip('"')
+            if not sha256 and re.fullmatch(r"[0-9a-f]{64}", etag):
+                sha256 = etag
+    return final_url, size, accepts_ranges, sha256
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Download:
+    """Download di un singolo file; progress(scaricati, totale) viene chiamata durante il trasferimento"""
+
+    def __init__(self, url, path, sha256=None, workers=WORKERS, chunk_size=CHUNK_SIZE,
+                 progress=None, timeout=TIMEOUT):
+        self.url = url
+        self.path = str(path)
+        self.sha256 = sha256
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress = progress or (lambda done, total: None)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.downloaded = 0
+
+    def run(self):
+        final_url, size, accepts_ranges, announced = probe(self.url, self.timeout)
+        expected = self.sha256 or announced
+
+        if size and accepts_ranges:
+            self.download_ranges(final_url, size)
+        else:
+            self.download_stream(final_url)
+
+        if expected:
+            actual = file_sha256(self.path)
+            if actual != expected:
+                os.remove(self.path)
+                if os.path.exists(state_path(self.path)):
+                    os.remove(state_path(self.path))
+                raise DownloadError(f"Checksum errato per {os.path.basename(self.path)}")
+        if os.path.exists(state_path(self.path)):
+            os.remove(state_path(self.path))
+        return self.path
+
+    def load_state(self, size):
+        """Blocchi già completati di un download precedente dello stesso file"""
+        try:
+            with open(state_path(self.path), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state["url"] == self.url and state["size"] == size and os.path.getsize(self.path) == size:
+                return set(state["done"])
+        except (OSError, ValueError, KeyError):
+            pass
+        return set()
+
+    def save_state(self, size, done):
+        tmp_path = f"{state_path(self.path)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "size": size, "done": sorted(done)}, f)
+        os.replace(tmp_path, state_path(self.path))
+
+    def download_ranges(self, url, size):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        chunks = [(i, start, min(start + self.chunk_size, size)) for i, start in enumerate(range(0, size, self.chunk_size))]
+
+        done = self.load_state(size)
+        if not done and os.path.exists(self.path) and os.path.getsize(self.path) == size and not os.path.exists(state_path(self.path)):
+            return  # Già scaricato: resta solo la verifica del checksum
+        self.save_state(size, done)
+        self.downloaded = sum(end - start for i, start, end in chunks if i in done)
+        self.progress(self.downloaded, size)
+
+        # Preallocazione: il file ha subito la dimensione finale e i blocchi vengono scritti al loro posto
+        with open(self.path, "r+b" if os.path.exists(self.path) else "w+b") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mapped:
+                def fetch(chunk):
+                    i, start, end = chunk
+                    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+                    with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                        if response.status != 206:
+                            raise DownloadError("Il server ha ignorato la richiesta Range")
+                        pos = start
+                        while pos < end:
+                            block = response.read(min(BLOCK_SIZE, end - pos))
+                            if not block:
+                                raise DownloadError("Connessione interrotta")
+                            mapped[pos:pos + len(block)] = block
+                            pos += len(block)
+                            with self.lock:
+                                self.downloaded += len(block)
+                                self.progress(self.downloaded, size)
+                    mapped.flush(start - start % mmap.ALLOCATIONGRANULARITY, end - start + start % mmap.ALLOCATIONGRANULARITY)
+                    with self.lock:
+                        done.add(i)
+                        self.save_state(size, done)
+
+                pending = [chunk for chunk in chunks if chunk[0] not in done]
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    # list() propaga la prima eccezione; i blocchi completati restano salvati
+                    list(pool.map(fetch, pending))
+
+    def download_stream(self, url):
+        """Server senza Range: download sequenziale, senza ripresa"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.save_state(0, [])
+        with urllib.request.urlopen(url, timeout=self.timeout) as response, open(self.path, "wb") as f:
+            total = int(response.headers.get("Content-Length") or 0)
+            for block in iter(lambda: response.read(BLOCK_SIZE), b""):
+                f.write(block)
+                self.downloaded += len(block)
+                self.progress(self.downloaded, total)
+
+
+def external_data_url(url, timeout=TIMEOUT):
+    """URL dei pesi esterni (model.onnx.data) pubblicati accanto al modello, None se non ci sono"""
+    try:
+        probe(f"{url}.data", timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+    return f"{url}.data"
+
+def download_model(model_info, base_dir, progress=None, workers=WORKERS):
+    """Scarica una voce di MODEL_CONFIGS nel suo percorso, con gli eventuali pesi esterni in <percorso>.data
+    (lo stesso nome che usano model_selector.model_size e ONNX Runtime)"""
+    path = os.path.join(str(base_dir), model_info["path"])
+    # Prima i pesi: finché manca il .onnx, is_complete non considera pronta la variante
+    data_url = external_data_url(model_info["url"])
+    if data_url:
+        Download(data_url, f"{path}.data", sha256=model_info.get("data_sha256"),
+                 workers=workers, progress=progress).run()
+    return Download(model_info["url"], path, sha256=model_info.get("sha256"),
+                    workers=workers, progress=progress).run()
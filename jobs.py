@@ -0,0 +1,120 @@
+# jobs.py
+# Coda dei lavori lunghi (immagini, OCR, risposte del modello): gli endpoint accodano il lavoro
+# e rispondono subito con un id; un pool limitato di worker li esegue in ordine di priorità.
+
+import os
+import time
+import uuid
+import queue
+import itertools
+import threading
+
+# Priorità: numeri più bassi passano prima
+INTERACTIVE = 0   # Chat
+NORMAL = 1        # Comandi (@immagine, @cerca)
+BACKGROUND = 2    # Allegati (OCR, analisi immagini)
+
+MAX_PENDING = 64
+JOB_TTL = 10 * 60  # Secondi per cui un risultato resta consultabile
+
+
+class QueueFull(Exception):
+    """Troppi lavori in attesa"""
+
+
+class Job:
+    def __init__(self, kind, func, args, priority):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.status = "queued"  # queued → running → done | failed
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.completed = threading.Event()
+
+    def wait(self, timeout=None):
+        """True se il lavoro è terminato entro il timeout"""
+        return self.completed.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "queued_time": (self.started or time.time()) - self.created,
+            "run_time": (self.finished or time.time()) - self.started if self.started else None
+        }
+
+
+class JobQueue:
+    """Coda a priorità con un worker per core: il lavoro CPU-intensivo non supera i core disponibili"""
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING, ttl=JOB_TTL):
+        self.workers = workers or os.cpu_count() or 2
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()  # A parità di priorità, FIFO
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, kind, func, *args, priority=NORMAL):
+        """Accoda func(*args); solleva QueueFull se ci sono già troppi lavori in attesa"""
+        with self.lock:
+            self.prune()
+            if sum(job.status == "queued" for job in self.jobs.values()) >= self.max_pending:
+                raise QueueFull("Troppi lavori in coda, riprova tra poco")
+            job = Job(kind, func, args, priority)
+            self.jobs[job.id] = job
+        self.start()
+        self.queue.put((priority, next(self.order), job))
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def work(self):
+        while True:
+            _, _, job = self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.result = job.func(*job.args)
+                job.status = "done"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+                print(f"❌ Lavoro {job.kind} fallito: {e}")
+            finally:
+                job.finished = time.time()
+                job.func = job.args = None  # Libera gli input (es. allegati in memoria)
+                job.completed.set()
+
+    def prune(self):
+        """Dimentica i lavori terminati da più di ttl secondi (chiamata con il lock)"""
+        now = time.time()
+        for job_id in [i for i, job in self.jobs.items() if job.finished and now - job.finished > self.ttl]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        with self.lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+        return {"workers": self.workers, **counts}
@@ -1,224 +1,141 @@
 # main.py
 
+# Solo ciò che serve alla prima schermata: TTS, wake word, comandi, indice app e server
+# vengono inizializzati al primo uso o nel riscaldamento in background (warm_up)
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
-from kivy.core.window import Window
 from kivy.clock import mainthread
 import threading
 import time
 import webbrowser
 import os
 import sys
-from pathlib import Path
-from cython import compile_file
-from jnius import autoclass, cast
 
 # --- GESTIONE CONFIGURAZIONE ---
-import json
-from pathlib import Path
+from assistant_config import BASE_DIR, MODEL_CONFIGS, load_config, save_config
 
 # --- PERCORSI ---
-BASE_DIR = Path(__file__).parent
-APP_PY = BASE_DIR / "app.py"
 GUI_PATH = BASE_DIR / "gui.html"
-CONFIG_FILE = BASE_DIR / "user_config.json"
 
-DEFAULT_CONFIG = {
-    "model_version": "balanced",
-    "use_cloud": False,
-    "wake_word_enabled": True
-}
+# --- API ESTERNE ---
+def show_api_key_manager():
+    # Il popup (e i widget Kivy che usa) si carica solo quando l'utente lo apre
+    from add_your_key import show_api_key_manager
+    show_api_key_manager()
 
-def load_config():
-    if CONFIG_FILE.exists():
-        try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            pass
-    return DEFAULT_CONFIG.copy()
+# --- COMANDI SAC ---
+def handle_sac_command(command, argument=""):
+    from commands import router
+    return router.dispatch(command, argument)
 
-def save_config(config):
-    try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2)
-        return True
-    except Exception as e:
-        print(f"❌ Errore salvataggio: {e}")
-        return False
-
-# Carica la configurazione all'avvio
-config = load_config()
-
-
-
-# --- IMPORTA MODULI DI LOGICA (senza interfaccia) ---
-from add_your_key import show_api_key_manager, get_api_keys
-
-# --- IDENTITÀ ---
-CES_IDENTITY = {
-    "name": "ArcadiaAI Assistant",
-    "creator": "Mirko Yuri Donato",
-    "version": "3.5",
-    "model": "Phi-3-mini (simulato)",
-    "license": "MPL 2.0",
-    "repository": "https://github.com/Mirko-linux/ArcadiaAI-Assistant"
-}
-
-# --- PAROLE BANNATE (anti-abuso) ---
-PAROLE_BANNATE = []
-
-MODEL_CONFIGS = {
-    "full": {
-        "url": "https://huggingface.co/microsoft/Phi-3-mini-4K-instruct-onnx/resolve/main/cpu-and-gpu-fp16/model.onnx",
-        "path": "assets/models/phi3-full.onnx",
-        "description": "Alta qualità, richiede 4GB+ RAM"
-    },
-    "balanced": {
-        "url": "https://huggingface.co/microsoft/Phi-3-mini-4K-instruct-onnx/resolve/main/cpu-int4-rtn-block-128/model.onnx",
-        "path": "assets/models/phi3-balanced.onnx",
-        "description": "Qualità e velocità bilanciate"
-    },
-    "light": {
-        "url": "https://huggingface.co/microsoft/Phi-3-mini-4K-instruct-onnx/resolve/main/cpu-int4-rtn-block-32/model.onnx",
-        "path": "assets/models/phi3-light.onnx",
-        "description": "Leggera, per dispositivi con poca RAM"
-    }
-}
+def apply_model_version():
+    from commands import apply_model_version
+    apply_model_version()
 
-# --- COMANDI SAC ---
-SAC_COMMANDS = {
-    "aiuto": "Mostra i comandi",
-    "info": "Informazioni su ArcadiaAI",
-    "cerca [query]": "Cerca su web",
-    "immagine [descrizione]": "Genera un'immagine",
-    "mappe [luogo]": "Mostra una mappa",
-    "app [nome]": "Cerca un'app",
-    "data": "Mostra data e ora",
-    "codice_sorgente": "Link al codice sorgente",
-    "telegraph [testo]": "Pubblica su Telegraph",
-    "telegram [link] [testo]": "Invia a un canale Telegram",
-    "esporta": "Esporta la chat"
-}
-
-# --- BACKEND CES-IMAGE ---
-CES_IMAGE_API = "https://arcadiaai.onrender.com/api/ces-image"
-
-# --- SIMULAZIONE LLM ---
+# --- LLM LOCALE ---
 def generate_phi3(prompt):
-    simple_responses = {
-        "ciao": "Ciao! Sono ArcadiaAI, il tuo assistente intelligente. 😊",
-        "come stai": "Sto benissimo, grazie per chiedere! Sono qui per aiutarti.",
-        "chi ti ha creato": "Sono stato creato da Mirko Yuri Donato con tanto amore per il software libero!",
-        "grazie": "Di nulla! Sono felice di esserti stato d'aiuto. 😊"
-    }
-    for key in simple_responses:
-        if key in prompt.lower():
-            return simple_responses[key]
-    return "Ho elaborato la tua richiesta. Per funzionalità avanzate, usa i comandi come '@aiuto'."
-
-from urllib.parse import quote_plus
+    """Risposta completa del modello Phi-3, passando dalla cache delle risposte del server"""
+    import app as backend
+    return backend.generate_reply(prompt)
+
+# Indice delle app installate: costruito una volta, poi aggiornato solo con i pacchetti cambiati
+app_index = None
+
+def get_app_index():
+    global app_index
+    if app_index is None:
+        from app_index import AppIndex, AndroidPackageSource
+        app_index = AppIndex(AndroidPackageSource, str(BASE_DIR / "app_index.json"))
+    return app_index
 
 def get_installed_apps():
-    """Restituisce una lista di app installate: [{'name': 'WhatsApp', 'package': 'com.whatsapp'}]"""
-    PythonActivity = autoclass('org.kivy.android.PythonActivity')
-    activity = PythonActivity.mActivity
-    pm = activity.getPackageManager()
-
-    apps = []
-    packages = pm.getInstalledPackages(0)
-    for package_info in packages:
-        package_info = cast('android.content.pm.PackageInfo', package_info)
-        app_name = package_info.applicationInfo.loadLabel(pm)
-        package_name = package_info.packageName
-        # Escludi app di sistema non apribili
-        if "android" not in package_name and not package_name.startswith("com.android."):
-            apps.append({
-                "name": app_name.lower(),
-                "package": package_name
-            })
-    return apps
+    """Restituisce una lista di app installate: [{'name': 'whatsapp', 'package': 'com.whatsapp'}]"""
+    index = get_app_index()
+    index.ensure_fresh()
+    return [{"name": name, "package": package} for package, name in index.apps.items()]
 
 def open_app_by_name(app_name):
-    """Apre un'app per nome (es. 'whatsapp', 'telegram')"""
+    """Apre un'app per nome (es. 'whatsapp', 'telegram'), tollerando errori di battitura"""
     app_name = app_name.lower().strip()
     
-    # Ottieni lista app installate
+    # Cerca nell'indice (esatto, prefisso o simile)
     try:
-        apps = get_installed_apps()
+        app = get_app_index().find(app_name)
     except Exception as e:
         return f"❌ Errore lettura app: {e}"
 
-    # Cerca corrispondenza (anche parziale)
-    for app in apps:
-        if app_name in app["name"] or app["name"] in app_name:
-            try:
-                Intent = autoclass('android.content.Intent')
-                PythonActivity = autoclass('org.kivy.android.PythonActivity')
-                activity = PythonActivity.mActivity
-                
-                intent = activity.getPackageManager().getLaunchIntentForPackage(app["package"])
-                if intent:
-                    activity.startActivity(intent)
-                    return f"✅ Aperto {app['name'].title()}"
-                else:
-                    return f"❌ Impossibile avviare {app['name']}"
-            except Exception as e:
-                return f"❌ Errore: {e}"
+    if app:
+        try:
+            from jnius import autoclass
+            PythonActivity = autoclass('org.kivy.android.PythonActivity')
+            activity = PythonActivity.mActivity
+            
+            intent = activity.getPackageManager().getLaunchIntentForPackage(app["package"])
+            if intent:
+                activity.startActivity(intent)
+                return f"✅ Aperto {app['name'].title()}"
+            else:
+                return f"❌ Impossibile avviare {app['name']}"
+        except Exception as e:
+            return f"❌ Errore: {e}"
     
     return f"❌ App '{app_name}' non trovata"
 
 # --- WAKE-WORD: "EHI ARCADIA" (solo Android) ---
 wake_word_enabled = False
-
-if hasattr(sys, 'getandroidapilevel'):  # Rileva Android
+WAKE_PHRASE = "ehi arcadia"
+WAKE_FRAME_SAMPLES = 4000  # 250 ms a 16 kHz
+WAKE_RING_FRAMES = 8       # Al massimo 2 s di audio in attesa: oltre si scartano i frame più vecchi
+wake_audio = None
+
+def start_wake_word():
+    """Avvia l'ascolto della wake word (solo Android), nel riscaldamento dopo la prima schermata"""
+    global wake_word_enabled, wake_audio
+    if not hasattr(sys, 'getandroidapilevel') or wake_word_enabled:  # Solo su Android, una volta
+        return
     try:
         from vosk import Model, KaldiRecognizer
         import sounddevice as sd
-        import queue
+        import requests
+        import json
+        from transcription import AudioRing
 
         VOSK_MODEL_PATH = str(BASE_DIR / "assets" / "models" / "vosk-model-small-it")
         if os.path.exists(VOSK_MODEL_PATH):
             vosk_model = Model(VOSK_MODEL_PATH)
-            recognizer = KaldiRecognizer(vosk_model, 16000)
-            audio_queue = queue.Queue()
+            # Grammatica ristretta: il decoder sceglie solo tra la frase di attivazione e "sconosciuto"
+            recognizer = KaldiRecognizer(vosk_model, 16000, json.dumps([WAKE_PHRASE, "[unk]"]))
+            wake_audio = AudioRing(WAKE_FRAME_SAMPLES * 2, WAKE_RING_FRAMES)
             wake_word_enabled = True
 
             def listen_for_wake():
-                with sd.InputStream(samplerate=16000, channels=1, callback=lambda indata, *args: audio_queue.put(bytes(indata)), blocksize=8000):
+                # RawInputStream: la callback riceve il buffer grezzo e lo copia nello slot preallocato
+                with sd.RawInputStream(samplerate=16000, channels=1, dtype='int16', blocksize=WAKE_FRAME_SAMPLES,
+                                       callback=lambda indata, *args: wake_audio.write(indata)):
                     while True:
-                        data = audio_queue.get()
+                        data = wake_audio.read()
                         if recognizer.AcceptWaveform(data):
-                            text = recognizer.Result()[14:-3].lower()
-                            if "ehi arcadia" in text:
-                                print("✅ Wake word rilevata!")
+                            text = json.loads(recognizer.Result()).get("text", "")
+                            if WAKE_PHRASE in text:
+                                print(f"✅ Wake word rilevata! (frame scartati: {wake_audio.dropped})")
+                                recognizer.Reset()
                                 # Puoi inviare un evento a Flask
-                                requests.post("http://localhost:5000/wake", json={"detected": True})
+                                try:
+                                    requests.post("http://localhost:5000/wake", json={"detected": True}, timeout=2)
+                                except requests.RequestException as e:
+                                    print(f"⚠️ Notifica wake word non inviata: {e}")
             threading.Thread(target=listen_for_wake, daemon=True).start()
     except Exception as e:
         print(f"❌ Vosk non disponibile: {e}")
 
 # --- SINTESI VOCALE (TTS) ---
-try:
-    from gtts import gTTS
-    import pygame
-    pygame.mixer.init()
-    def speak_text(text):
-        try:
-            tts = gTTS(text=text, lang='it', slow=False)
-            filepath = str(BASE_DIR / "speech.mp3")
-            tts.save(filepath)
-            pygame.mixer.music.load(filepath)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-        except Exception as e:
-            print("❌ TTS fallito:", e)
-except:
-    def speak_text(text):
-        print(f"[TTS] {text}")
+def speak_text(text):
+    """Legge la risposta frase per frase (tts.py): l'audio parte dopo la prima frase"""
+    from tts import speaker
+    speaker.speak(text)
+
 def show_model_choice_popup():
     from kivy.uix.popup import Popup
     from kivy.uix.boxlayout import BoxLayout
@@ -249,7 +166,8 @@ def show_model_choice_popup():
         def on_press(k=key):
             config["model_version"] = k
             save_config(config)
-            App.get_running_app().chatbox.add_message(f"✅ Modello impostato su {k}. Riavvia per applicare.")
+            apply_model_version()
+            App.get_running_app().chatbox.add_message(f"✅ Modello impostato su {k}.")
             popup.dismiss()
 
         btn.bind(on_press=on_press)
@@ -264,99 +182,61 @@ def show_model_choice_popup():
 
 phi3_session = None
 phi3_tokenizer = None
+phi3_engine = None
 
 def load_phi3_model():
-    global phi3_session, phi3_tokenizer
-
-    config = load_config()
-    model_key = config.get("model_version", "balanced")
-    model_info = MODEL_CONFIGS[model_key]
-
-    if not os.path.exists(model_info["path"]):
-        App.get_running_app().chatbox.add_message(
-            f"⚠️ Modello {model_key} non trovato. Usa `@aiuto` per scaricarlo."
-        )
+    """Usa il motore del server (caricato una sola volta, in background all'avvio)"""
+    global phi3_session, phi3_tokenizer, phi3_engine
+    import app as backend
+
+    phi3_engine = backend.load_phi3_engine()
+    if phi3_engine is None:
+        model_key = load_config().get("model_version", "balanced")
+        print(f"⚠️ Modello {model_key} non disponibile: {backend.load_status['stage']}")
         return None, None
 
-    try:
-        from transformers import AutoTokenizer
-        import onnxruntime as ort
-
-        print(f"🔄 Caricamento modello: {model_key}...")
-        phi3_tokenizer = AutoTokenizer.from_pretrained("microsoft/Phi-3-mini-4K-instruct")
-        phi3_session = ort.InferenceSession(
-            model_info["path"],
-            providers=['CPUExecutionProvider']
-        )
-        print("✅ Modello caricato!")
-        return phi3_session, phi3_tokenizer
-    except Exception as e:
-        print(f"❌ Errore caricamento: {e}")
-        return None, None
+    phi3_session = phi3_engine.session
+    phi3_tokenizer = phi3_engine.tokenizer
+    return phi3_session, phi3_tokenizer
     
 
 
 # --- GESTIONE COMANDI ---
-def handle_sac_command(command, argument=""):
-    command = command.lower().strip()
-    if command == "apri" and argument:
-        return open_app_by_name(argument)
-    if command == "aiuto":
-        return "[b]🎯 Comandi disponibili:[/b]\n" + "\n".join([f"- [i]@{cmd}[/i] → {desc}" for cmd, desc in SAC_COMMANDS.items()])
-    elif command == "info":
-        return f"[b]ℹ️ {CES_IDENTITY['name']} v{CES_IDENTITY['version']}[/b]\n• Creatore: {CES_IDENTITY['creator']}\n• Modello: {CES_IDENTITY['model']}\n• [ref={CES_IDENTITY['repository']}][color=0000ff]Codice sorgente[/color][/ref]"
-    elif command == "data":
-        from datetime import datetime
-        return f"📅 Oggi è {datetime.now().strftime('%d/%m/%Y, %H:%M')}"
-    elif command == "modello":
-        if not argument:
-            current = config.get("model_version", "balanced")
-            return (
-                f"🔧 **Modello attuale**: {current}\n\n"
-                "Disponibili:\n"
-                "• `@modello completa`\n"
-                "• `@modello bilanciata`\n"
-                "• `@modello leggera`\n\n"
-                "Usa `@aiuto` per scaricare il modello scelto."
-            )
-        elif argument in ["completa", "bilanciata", "leggera"]:
-            config["model_version"] = {"completa": "full", "bilanciata": "balanced", "leggera": "light"}[argument]
-            save_config(config)
-            return f"✅ Modello impostato su **{argument}**. Riavvia per applicare."
-        else:
-            return "❌ Usa: `@modello [completa|bilanciata|leggera]`"
-    elif command == "cerca" and argument:
-        try:
-            from duckduckgo_search import ddg
-            results = ddg(argument, max_results=3)
-            return "\n".join([f"[ref={r['href']}][color=0000ff][u]{r['title']}[/u][/color][/ref]" for r in results])
-        except:
-            return "❌ Ricerca fallita."
-    elif command == "immagine" and argument:
-        if not argument:
-            return "❌ Specifica cosa disegnare."
-        if any(parola in argument.lower() for parola in PAROLE_BANNATE):
-            return "❌ Questo prompt non è consentito."
-        try:
-            import requests
-            response = requests.post(CES_IMAGE_API, json={"prompt": argument}, timeout=20)
-            if response.status_code == 200:
-                data = response.json()
-                return "__IMAGE__:" + data.get("image_url") if data.get("image_url") else "⚠️ Nessuna immagine."
-            return f"❌ Errore API: {response.status_code}"
-        except Exception as e:
-            return f"❌ Errore: {e}"
-    else:
-        return "❌ Comando non riconosciuto. Usa `@aiuto`."
-    
+def register_device_commands():
+    """@apri funziona solo sul dispositivo: si registra qui, gli altri comandi stanno in commands.py"""
+    from commands import router
+    router.register("apri", argument="nome", required=True)(open_app_by_name)
+
 # --- AVVIA IL SERVER FLASK ---
+SERVER_START_TIMEOUT = 120  # Secondi massimi di attesa per il caricamento dei modelli
+
 def start_flask_server():
-    import subprocess
-    subprocess.Popen([sys.executable, str(APP_PY)], cwd=BASE_DIR)
+    """Avvia il server nello stesso processo del launcher, riusandolo se è già attivo"""
+    import app as backend
+    if backend.server_status() is None:
+        try:
+            backend.start_server()
+        except OSError as e:
+            # Porta occupata: un'altra istanza risponderà a /health
+            print(f"⚠️ Porta {backend.SERVER_PORT} occupata: {e}")
+    return backend
+
+def warm_up():
+    """Riscaldamento in background dopo la prima schermata: server e modelli, comandi, wake word"""
+    # Il server gira nello stesso processo: le durate compaiono nel suo /metrics
+    from metrics import registry
+    stages = registry.gauge("arcadia_startup_stage_seconds", "Durata delle fasi di avvio del launcher", ["stage"])
+    registry.gauge("arcadia_wake_frames_dropped", "Frame audio della wake word scartati dal buffer",
+                   function=lambda: wake_audio.stats()["dropped"] if wake_audio else None)
+    for stage, step in (("comandi", register_device_commands), ("server", start_flask_server),
+                        ("wake_word", start_wake_word)):
+        with stages.time(stage=stage):
+            step()
 
 # --- APP KIVY (SOLO LAUNCHER) ---
 class ArcadiaAIApp(App):
     def build(self):
+        from kivy.core.window import Window
         Window.clearcolor = (0.9, 0.95, 1, 1)
         layout = BoxLayout(orientation='vertical', padding=20, spacing=15)
 
@@ -406,12 +286,34 @@ class ArcadiaAIApp(App):
 
         return layout
 
+    def on_start(self):
+        # Server e modelli partono subito, mentre l'utente è ancora sul launcher
+        threading.Thread(target=warm_up, daemon=True).start()
+
     def start_assistant(self, *args):
         self.status.text = "Avvio server..."
-        threading.Thread(target=start_flask_server, daemon=True).start()
-        time.sleep(2)
-        webbrowser.open("http://localhost:5000")
-        self.status.text = "✅ Aperto in browser!"
+        threading.Thread(target=self.wait_for_server, daemon=True).start()
+
+    def wait_for_server(self):
+        """Interroga /health finché il server non ha caricato i modelli, poi apre la GUI"""
+        backend = start_flask_server()
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            status = backend.server_status()
+            if status and status["ready"]:
+                break
+            if status:
+                loading = status["loading"]
+                self.set_status(f"Caricamento modello {loading['progress']}% ({loading['stage']})")
+            else:
+                self.set_status("Avvio server...")
+            time.sleep(0.25)
+        webbrowser.open(backend.SERVER_URL)
+        self.set_status("✅ Aperto in browser!")
+
+    @mainthread
+    def set_status(self, text):
+        self.status.text = text
 
 # --- AVVIO ---
 if __name__ == '__main__':
@@ -0,0 +1,221 @@
+# metrics.py
+# Metriche in formato testo di Prometheus (contatori, gauge, istogrammi) senza dipendenze
+# esterne, esposte da app.py su /metrics. In più, tracce opzionali per richiesta: gli span
+# registrati nel thread della richiesta finiscono nell'header Server-Timing e nel log.
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Serie per combinazione di etichette; le etichette mancanti valgono stringa vuota"""
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # valori delle etichette -> valore
+        self.lock = threading.Lock()
+        self.function = function
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self):
+        """(suffisso, valori delle etichette, etichette extra, valore)"""
+        if self.function is not None:
+            yield from self.read_function()
+            return
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def read_function(self):
+        """Valori letti da `function` a ogni lettura di /metrics: un numero o, con etichette,
+        un dizionario {valore etichetta: numero}"""
+        try:
+            values = self.function()
+        except Exception:
+            return  # Sorgente non ancora disponibile (es. modello in caricamento)
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            if value is not None:
+                yield "", key if isinstance(key, tuple) else (key,), (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labels, key, extra)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Valore che cresce soltanto; con `function` riporta un totale già contato altrove (es. le cache)"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Valore impostato dal codice, oppure letto da `function` a ogni lettura di /metrics"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.set(time.perf_counter() - start, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", key, (("le", format_value(bound)),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), cumulative
+
+
+class Registry:
+    """Metriche per nome: registrare due volte lo stesso nome restituisce quella esistente"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=(), function=None):
+        return self.register(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self.register(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+
+# --- TRACCE ---
+class Trace:
+    """Span (nome, inizio relativo, durata) di una richiesta"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, start, end):
+        self.spans.append((name, start - self.start, end - start))
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, _, duration in self.spans)
+
+    def summary(self):
+        total = (time.perf_counter() - self.start) * 1000
+        spans = " ".join(f"{name}@{offset * 1000:.0f}+{duration * 1000:.0f}ms"
+                         for name, offset, duration in self.spans)
+        return f"{self.name} {total:.0f} ms: {spans or 'nessuno span'}"
+
+
+local = threading.local()
+
+def start_trace(name):
+    local.trace = Trace(name)
+    return local.trace
+
+def current_trace():
+    return getattr(local, "trace", None)
+
+def end_trace():
+    trace, local.trace = current_trace(), None
+    return trace
+
+def record_span(name, start, end=None):
+    """Aggiunge uno span misurato altrove (es. attraverso un generatore) alla traccia attiva"""
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() if end is None else end)
+
+@contextmanager
+def span(name):
+    """Misura un blocco nella traccia della richiesta corrente (nessun costo senza traccia attiva)"""
+    if current_trace() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, start)
@@ -0,0 +1,89 @@
+# model_selector.py
+# Scelta automatica della variante di Phi-3 (MODEL_CONFIGS) in base alla RAM libera
+# e alla velocità misurata sul dispositivo
+
+import os
+
+from assistant_config import MODEL_CONFIGS
+from downloader import is_complete
+from phi3_engine import format_prompt
+
+# Dalla variante più accurata alla più leggera
+QUALITY_ORDER = list(MODEL_CONFIGS)
+
+TARGET_TOKENS_PER_SECOND = 5.0
+MEMORY_HEADROOM = 1.2                     # RAM necessaria ≈ dimensione dei pesi x margine
+MEMORY_PRESSURE_BYTES = 300 * 1024 ** 2   # Sotto questa soglia si passa a una variante più leggera
+CALIBRATION_TOKENS = 16
+CALIBRATION_PROMPT = "Ciao, presentati in una frase."
+
+def available_memory():
+    """RAM disponibile in byte (Linux/Android), None se non misurabile"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return None
+
+def model_size(path):
+    """Byte occupati dal modello, compresi i pesi esterni (.onnx.data)"""
+    total = 0
+    for candidate in (path, f"{path}.data"):
+        if os.path.exists(candidate):
+            total += os.path.getsize(candidate)
+    return total
+
+def installed_variants(base_dir):
+    """Varianti presenti su disco, in ordine di qualità"""
+    return [key for key in QUALITY_ORDER if is_complete(os.path.join(base_dir, MODEL_CONFIGS[key]["path"]))]
+
+def fits_in_memory(key, base_dir, free_memory):
+    if free_memory is None:
+        return True
+    return model_size(os.path.join(base_dir, MODEL_CONFIGS[key]["path"])) * MEMORY_HEADROOM <= free_memory
+
+def calibrate(engine, tokens=CALIBRATION_TOKENS):
+    """Breve decodifica greedy: restituisce i token al secondo"""
+    generation = engine.generate(engine.encode(format_prompt(CALIBRATION_PROMPT)),
+                                 max_new_tokens=tokens, temperature=0)
+    for _ in generation:
+        pass
+    return generation.tokens_per_second
+
+def select_variant(candidates, open_variant, measurements, base_dir,
+                   target=TARGET_TOKENS_PER_SECOND, free_memory=None):
+    """Sceglie la variante più accurata che entra in memoria e raggiunge l'obiettivo di velocità.
+
+    measurements (chiave -> token/s) viene aggiornato con le nuove calibrazioni.
+    Restituisce (chiave, motore già caricato o None)."""
+    fitting = [key for key in candidates if fits_in_memory(key, base_dir, free_memory)] or candidates[-1:]
+
+    for key in fitting:
+        if key not in measurements:
+            engine = open_variant(key)
+            measurements[key] = calibrate(engine)
+            print(f"⏱️ Variante {key}: {measurements[key]:.1f} token/s")
+            if measurements[key] >= target:
+                return key, engine
+            del engine
+        elif measurements[key] >= target:
+            return key, None
+
+    # Nessuna variante raggiunge l'obiettivo: si usa la più veloce
+    return max(fitting, key=lambda key: measurements.get(key, 0.0)), None
+
+def lighter_variant(current, candidates):
+    """Prima variante installata più leggera di quella attuale, se esiste"""
+    if current not in QUALITY_ORDER:
+        return None
+    for key in QUALITY_ORDER[QUALITY_ORDER.index(current) + 1:]:
+        if key in candidates:
+            return key
+    return None
@@ -0,0 +1,261 @@
+# phi3_engine.py
+# Generazione autoregressiva con Phi-3-mini (ONNX Runtime)
+# Il prompt viene elaborato una sola volta (prefill), poi ogni passo di decodifica
+# riceve solo l'ultimo token e riusa i tensori past_key_values del passo precedente.
+
+import os
+import time
+import numpy as np
+
+PHI3_TOKENIZER = "microsoft/Phi-3-mini-4K-instruct"
+MAX_CONTEXT = 4096
+
+# Dimensioni di Phi-3-mini, usate se il grafo ONNX ha assi simbolici
+DEFAULT_KV_HEADS = 32
+DEFAULT_HEAD_SIZE = 96
+
+STOP_TOKENS = ["<|end|>", "<|endoftext|>", "<|user|>", "<|assistant|>"]
+
+# Risposte di riserva quando il modello non è installato
+FALLBACK_RESPONSES = {
+    "ciao": "Ciao! Sono ArcadiaAI, il tuo assistente intelligente. 😊",
+    "come stai": "Sto benissimo, grazie per chiedere! Sono qui per aiutarti.",
+    "chi ti ha creato": "Sono stato creato da Mirko Yuri Donato con tanto amore per il software libero!",
+    "grazie": "Di nulla! Sono felice di esserti stato d'aiuto. 😊"
+}
+
+def fallback_reply(prompt):
+    """Risposta predefinita usata senza modello locale"""
+    for key in FALLBACK_RESPONSES:
+        if key in prompt.lower():
+            return FALLBACK_RESPONSES[key]
+    return "Ho elaborato la tua richiesta. Per funzionalità avanzate, usa i comandi come '@aiuto'."
+
+def format_prompt(message):
+    """Applica il formato chat di Phi-3 a un singolo messaggio utente"""
+    return f"<|user|>\n{message}<|end|>\n<|assistant|>\n"
+
+def format_system(text):
+    """Blocco di sistema di Phi-3"""
+    return f"<|system|>\n{text}<|end|>\n"
+
+def sample_token(logits, temperature=0.7, top_p=0.9, rng=None):
+    """Sceglie il prossimo token dai logits (greedy se temperature <= 0)"""
+    logits = logits.astype(np.float32)
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    rng = rng or np.random.default_rng()
+    logits = logits / temperature
+    probs = np.exp(logits - logits.max())
+    probs /= probs.sum()
+    if top_p < 1.0:
+        order = np.argsort(probs)[::-1]
+        cumulative = np.cumsum(probs[order])
+        keep = order[:int(np.searchsorted(cumulative, top_p)) + 1]
+        filtered = np.zeros_like(probs)
+        filtered[keep] = probs[keep]
+        probs = filtered / filtered.sum()
+    return int(rng.choice(len(probs), p=probs))
+
+
+class KVCache:
+    """Tensori past_key_values di una sequenza già elaborata"""
+
+    def __init__(self, tensors, token_ids):
+        self.tensors = tensors
+        self.token_ids = list(token_ids)
+
+    def __len__(self):
+        return len(self.token_ids)
+
+
+class Phi3Engine:
+    """Motore di decodifica su una sessione ONNX Runtime già caricata"""
+
+    def __init__(self, session, tokenizer, max_context=MAX_CONTEXT):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.max_context = max_context
+
+        inputs = session.get_inputs()
+        self.input_names = {i.name for i in inputs}
+        self.past_inputs = [i for i in inputs if i.name.startswith("past_key_values")]
+        self.output_names = [o.name for o in session.get_outputs()]
+
+        # past_key_values.N.key -> present.N.key
+        self.present_to_past = {
+            name: name.replace("present", "past_key_values", 1)
+            for name in self.output_names if name.startswith("present")
+        }
+
+        # Forma dei tensori: [batch, kv_heads, seq_len, head_size]
+        shape = self.past_inputs[0].shape if self.past_inputs else []
+        self.kv_heads = shape[1] if len(shape) == 4 and isinstance(shape[1], int) else DEFAULT_KV_HEADS
+        self.head_size = shape[3] if len(shape) == 4 and isinstance(shape[3], int) else DEFAULT_HEAD_SIZE
+        kv_type = self.past_inputs[0].type if self.past_inputs else "tensor(float)"
+        self.kv_dtype = np.float16 if "float16" in kv_type else np.float32
+
+        self.stop_ids = set()
+        for token in STOP_TOKENS:
+            token_id = tokenizer.convert_tokens_to_ids(token)
+            if isinstance(token_id, int) and token_id != tokenizer.unk_token_id:
+                self.stop_ids.add(token_id)
+        if tokenizer.eos_token_id is not None:
+            self.stop_ids.add(tokenizer.eos_token_id)
+
+        # KV-cache del prompt di sistema, condivisa (in sola lettura) da tutte le richieste
+        self.prefix_cache = None
+
+    def encode(self, text, add_special_tokens=True):
+        return self.tokenizer.encode(text, add_special_tokens=add_special_tokens)
+
+    def empty_cache(self):
+        """Cache vuota (nessun token elaborato)"""
+        tensors = {
+            i.name: np.zeros((1, self.kv_heads, 0, self.head_size), dtype=self.kv_dtype)
+            for i in self.past_inputs
+        }
+        return KVCache(tensors, [])
+
+    def set_system_prompt(self, text):
+        """Esegue una sola volta il prefill del prompt di sistema e ne conserva la KV-cache"""
+        if not text:
+            self.prefix_cache = None
+            return
+        _, self.prefix_cache = self.forward(self.encode(format_system(text)), self.empty_cache())
+
+    def start_cache(self):
+        """Cache da cui parte ogni nuova conversazione"""
+        return self.prefix_cache if self.prefix_cache is not None else self.empty_cache()
+
+    def warmup(self):
+        """Un passo di decodifica a vuoto: ottimizzazioni e allocazioni non pesano sulla prima richiesta"""
+        self.forward(self.encode("Ciao", add_special_tokens=False)[:1], self.start_cache())
+
+    def forward(self, token_ids, cache):
+        """Elabora solo i nuovi token partendo dalla cache; restituisce (logits ultimo token, nuova cache)"""
+        past_len = len(cache)
+        new_len = len(token_ids)
+        feeds = {
+            "input_ids": np.array([token_ids], dtype=np.int64),
+            "attention_mask": np.ones((1, past_len + new_len), dtype=np.int64),
+        }
+        if "position_ids" in self.input_names:
+            feeds["position_ids"] = np.arange(past_len, past_len + new_len, dtype=np.int64)[None, :]
+        feeds.update(cache.tensors)
+
+        outputs = dict(zip(self.output_names, self.session.run(self.output_names, feeds)))
+        tensors = {past: outputs[present] for present, past in self.present_to_past.items()}
+        return outputs["logits"][0, -1], KVCache(tensors, cache.token_ids + list(token_ids))
+
+    def generate(self, token_ids, cache=None, max_new_tokens=256, temperature=0.7, top_p=0.9):
+        """Avvia una generazione in streaming (iterare per ottenere i frammenti di testo)"""
+        return Generation(self, token_ids, cache, max_new_tokens, temperature, top_p)
+
+    def stream_chat(self, message, **sampling):
+        """Genera la risposta a un messaggio, frammento per frammento"""
+        # forward() non modifica mai i tensori ricevuti: il prefisso si può riusare così com'è
+        cache = self.start_cache()
+        token_ids = self.encode(format_prompt(message), add_special_tokens=not len(cache))
+        return self.generate(token_ids, cache=cache, **sampling)
+
+
+class Generation:
+    """Singola generazione: iterabile sui frammenti di testo, espone cache e tempi a fine corsa"""
+
+    def __init__(self, engine, token_ids, cache, max_new_tokens, temperature, top_p):
+        self.engine = engine
+        self.prompt_ids = list(token_ids)
+        self.cache = cache if cache is not None else engine.empty_cache()
+        self.temperature = temperature
+        self.top_p = top_p
+        self.output_ids = []
+
+        # Il prompt non può superare il contesto: si tengono gli ultimi token senza cache
+        room = engine.max_context - len(self.cache) - len(self.prompt_ids)
+        if room <= 0:
+            keep = max(engine.max_context - max_new_tokens, 1)
+            self.prompt_ids = (self.cache.token_ids + self.prompt_ids)[-keep:]
+            self.cache = engine.empty_cache()
+            room = engine.max_context - len(self.prompt_ids)
+        self.max_new_tokens = min(max_new_tokens, room)
+
+        self.prefill_time = 0.0
+        self.decode_time = 0.0
+        self.first_token_time = None
+
+    def __iter__(self):
+        engine = self.engine
+        start = time.perf_counter()
+        logits, self.cache = engine.forward(self.prompt_ids, self.cache)
+        self.prefill_time = time.perf_counter() - start
+
+        # Detokenizzazione incrementale: decodifica solo la finestra dall'ultimo confine stampabile
+        prefix_offset = read_offset = 0
+        decode_start = time.perf_counter()
+        for _ in range(self.max_new_tokens):
+            token_id = sample_token(logits, self.temperature, self.top_p)
+            if token_id in engine.stop_ids:
+                break
+            self.output_ids.append(token_id)
+
+            prefix_text = engine.tokenizer.decode(self.output_ids[prefix_offset:read_offset], skip_special_tokens=True)
+            new_text = engine.tokenizer.decode(self.output_ids[prefix_offset:], skip_special_tokens=True)
+            if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
+                if self.first_token_time is None:
+                    self.first_token_time = time.perf_counter() - start
+                yield new_text[len(prefix_text):]
+                prefix_offset = read_offset
+                read_offset = len(self.output_ids)
+
+            if len(self.output_ids) >= self.max_new_tokens:
+                break
+            logits, self.cache = engine.forward([token_id], self.cache)
+        self.decode_time = time.perf_counter() - decode_start
+
+    @property
+    def tokens_per_second(self):
+        return len(self.output_ids) / self.decode_time if self.decode_time else 0.0
+
+
+def load_tokenizer(tokenizer_dir=None):
+    """Tokenizer dalla cartella locale; se manca lo scarica una volta e lo salva lì"""
+    from transformers import AutoTokenizer
+
+    if tokenizer_dir and os.path.exists(os.path.join(tokenizer_dir, "tokenizer_config.json")):
+        return AutoTokenizer.from_pretrained(tokenizer_dir, local_files_only=True)
+    tokenizer = AutoTokenizer.from_pretrained(PHI3_TOKENIZER)
+    if tokenizer_dir:
+        tokenizer.save_pretrained(tokenizer_dir)
+    return tokenizer
+
+def create_session(model_path, disable_prepacking=False):
+    """Sessione ONNX Runtime per CPU. ORT mappa già da solo i pesi esterni allineati (model.onnx.data);
+    il prepacking va lasciato attivo: i kernel int4 (MatMulNBits) delle varianti balanced e light
+    lo usano per il percorso veloce e senza riconvertono i pesi a ogni chiamata.
+    disable_prepacking risparmia la copia prepacchettata dei pesi a scapito dei token/s:
+    usarlo solo dopo averlo misurato (python benchmark_api.py --no-prepacking)."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if disable_prepacking:
+        options.add_session_config_entry("session.disable_prepacking", "1")
+    return ort.InferenceSession(str(model_path), sess_options=options, providers=['CPUExecutionProvider'])
+
+def load_engine(model_path, system_prompt=None, tokenizer_dir=None, progress=None, disable_prepacking=False):
+    """Carica tokenizer e sessione ONNX, prepara il prompt di sistema e fa un passo di riscaldamento.
+    progress(fase, percentuale) viene chiamata a ogni fase del caricamento."""
+    report = progress or (lambda stage, percent: None)
+
+    report("tokenizer", 5)
+    tokenizer = load_tokenizer(tokenizer_dir)
+    report("modello", 20)
+    session = create_session(model_path, disable_prepacking)
+    engine = Phi3Engine(session, tokenizer)
+    report("prompt di sistema", 70)
+    engine.set_system_prompt(system_prompt)
+    report("riscaldamento", 90)
+    engine.warmup()
+    report("pronto", 100)
+    return engine
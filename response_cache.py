@@ -0,0 +1,117 @@
+# response_cache.py
+# Cache delle risposte del modello: domande ricorrenti ("ciao", "che ore sono")
+# non ripassano dall'inferenza. Chiave = prompt normalizzato + variante + parametri.
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+MAX_ENTRIES = 512
+TTL_SECONDS = 7 * 24 * 3600
+SAVE_INTERVAL = 30  # Secondi minimi tra due salvataggi su disco
+
+def normalize_prompt(prompt):
+    """Minuscole, senza accenti, punteggiatura e spazi ripetuti"""
+    text = unicodedata.normalize("NFKD", prompt.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def make_key(prompt, model_key, **sampling):
+    """Chiave di cache per prompt, variante del modello (MODEL_CONFIGS) e parametri di campionamento"""
+    params = ",".join(f"{k}={sampling[k]}" for k in sorted(sampling))
+    raw = f"{model_key}|{params}|{normalize_prompt(prompt)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def entry_size(reply):
+    return len(reply) if isinstance(reply, str) else 0
+
+
+class ResponseCache:
+    """LRU con scadenza, persistita su file JSON; max_chars limita anche la dimensione totale"""
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, max_chars=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self.entries = OrderedDict()  # chiave -> (timestamp, risposta)
+        self.chars = 0                # Caratteri totali delle risposte testuali
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.last_save = 0.0
+        self.load()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[0] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                self.remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, reply):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.time(), reply)
+            self.chars += entry_size(reply)
+            while len(self.entries) > self.max_entries or (self.max_chars and self.chars > self.max_chars and len(self.entries) > 1):
+                self.remove(next(iter(self.entries)))
+            due = time.time() - self.last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def remove(self, key):
+        """Elimina una voce (chiamata con il lock)"""
+        self.chars -= entry_size(self.entries.pop(key)[1])
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.entries),
+                "chars": self.chars
+            }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for key, (timestamp, reply) in data.items():
+                if now - timestamp <= self.ttl:
+                    self.entries[key] = (timestamp, reply)
+                    self.chars += entry_size(reply)
+        except Exception as e:
+            print(f"⚠️ Cache risposte illeggibile: {e}")
+
+    def save(self):
+        """Scrittura atomica: file temporaneo poi rinomina"""
+        if not self.path:
+            return
+        with self.lock:
+            data = dict(self.entries)
+            self.last_save = time.time()
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"❌ Errore salvataggio cache: {e}")
@@ -0,0 +1,123 @@
+# Test di AppIndex con una sorgente di pacchetti finta (nessun dispositivo Android)
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app_index
+from app_index import AppIndex
+
+
+class FakePackageSource:
+    """Imita PackageManager: sequenza delle modifiche che riparte da 0 a ogni riavvio"""
+
+    def __init__(self, apps=None, boot_count=1):
+        self.apps = dict(apps or {})
+        self.boots = boot_count
+        self.changes = []  # (sequenza, pacchetto) dall'ultimo avvio
+        self.full_scans = 0
+
+    def install(self, package_name, name):
+        self.apps[package_name] = name
+        self.changes.append((len(self.changes) + 1, package_name))
+
+    def reboot(self):
+        self.boots += 1
+        self.changes = []
+
+    def boot_count(self):
+        return self.boots
+
+    def list_packages(self):
+        self.full_scans += 1
+        return dict(self.apps)
+
+    def changed_packages(self, sequence):
+        current = len(self.changes)
+        packages = [p for s, p in self.changes if s > sequence]
+        return (current, packages) if packages else (sequence, [])
+
+    def label(self, package_name):
+        return self.apps.get(package_name)
+
+
+def make_index(source, path):
+    return AppIndex(lambda: source, str(path))
+
+
+def test_incremental_refresh_picks_up_new_app(tmp_path):
+    source = FakePackageSource({"org.mozilla.firefox": "Firefox"})
+    index = make_index(source, tmp_path / "index.json")
+    index.refresh()
+    source.install("org.telegram.messenger", "Telegram")
+
+    assert index.find("telegram")["package"] == "org.telegram.messenger"
+    assert source.full_scans == 1
+
+
+def test_reboot_resets_sequence(tmp_path):
+    source = FakePackageSource({"org.mozilla.firefox": "Firefox"})
+    for i in range(150):
+        source.install(f"com.example.app{i}", f"Esempio {i}")
+    make_index(source, tmp_path / "index.json").refresh()
+
+    # Dopo il riavvio la sequenza riparte: WhatsApp arriva con sequenza 3 < 150
+    source.reboot()
+    for i in range(2):
+        source.install(f"com.example.other{i}", f"Altro {i}")
+    source.install("com.whatsapp", "WhatsApp")
+
+    index = make_index(source, tmp_path / "index.json")
+    assert index.find("whatsapp")["package"] == "com.whatsapp"
+    assert index.sequence == 3
+
+
+def test_sequence_going_backwards_forces_full_scan(tmp_path):
+    source = FakePackageSource({"org.mozilla.firefox": "Firefox"})
+    source.boot_count = lambda: None  # Contatore degli avvii non disponibile
+    for i in range(10):
+        source.install(f"com.example.app{i}", f"Esempio {i}")
+    index = make_index(source, tmp_path / "index.json")
+    index.refresh()
+
+    source.changes = []
+    source.install("com.whatsapp", "WhatsApp")
+    source.install("com.spotify.music", "Spotify")
+    source.changed_packages = lambda sequence: (2, [])  # Sequenza più bassa di quella salvata
+
+    index.refresh()
+    assert index.lookup("whatsapp")["package"] == "com.whatsapp"
+    assert source.full_scans == 2
+
+
+def test_daily_full_refresh_with_changes_api(tmp_path, monkeypatch):
+    source = FakePackageSource({"org.mozilla.firefox": "Firefox"})
+    index = make_index(source, tmp_path / "index.json")
+    index.refresh()
+    index.refresh()
+    assert source.full_scans == 1
+
+    now = time.time()
+    monkeypatch.setattr(app_index.time, "time", lambda: now + app_index.FULL_REFRESH_INTERVAL + 1)
+    index.refresh()
+    assert source.full_scans == 2
+
+
+def test_refresh_without_changes_skips_rebuild_and_save(tmp_path, monkeypatch):
+    source = FakePackageSource({"org.mozilla.firefox": "Firefox"})
+    index = make_index(source, tmp_path / "index.json")
+    index.refresh()
+
+    calls = []
+    monkeypatch.setattr(index, "rebuild", lambda: calls.append("rebuild"))
+    monkeypatch.setattr(index, "save", lambda: calls.append("save"))
+    checked = index.last_check
+    index.refresh()
+    assert calls == []
+    assert index.last_check >= checked
+
+    source.install("com.whatsapp", "WhatsApp")
+    index.refresh()
+    assert calls == ["rebuild", "save"]
+    assert index.sequence == 1
@@ -0,0 +1,168 @@
+# Test di downloader.py contro un server HTTP locale che imita Hugging Face (richieste Range)
+import os
+import sys
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import Download, DownloadError, download_model, is_complete, state_path
+
+CHUNK = 1024
+PAYLOAD = os.urandom(CHUNK * 8 + 100)  # L'ultimo blocco è parziale
+
+
+class FileServer(ThreadingHTTPServer):
+    """Serve i file in `files`; registra le richieste Range e può farne fallire alcune una volta"""
+    daemon_threads = True
+
+    def __init__(self, files, ranges=True):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.files = files
+        self.ranges = ranges
+        self.fail_once = set()  # Byte iniziali delle richieste Range da rifiutare una volta
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.server_address[1]}/{name}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_headers(self, data):
+        self.send_header("Content-Length", str(len(data)))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_headers(data)
+
+    def do_GET(self):
+        data = self.server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        header = self.headers.get("Range")
+        if not (header and self.server.ranges):
+            self.send_response(200)
+            self.send_headers(data)
+            self.wfile.write(data)
+            return
+        start, end = (int(n) for n in header.removeprefix("bytes=").split("-"))
+        with self.server.lock:
+            self.server.requested.append(start)
+            failing = start in self.server.fail_once
+            self.server.fail_once.discard(start)
+        if failing:
+            self.send_error(500)
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_headers(data[start:end + 1])
+        self.wfile.write(data[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(files=None, ranges=True):
+        instance = FileServer(files or {"model.onnx": PAYLOAD}, ranges)
+        threading.Thread(target=instance.serve_forever, daemon=True).start()
+        servers.append(instance)
+        return instance
+
+    yield start
+    for instance in servers:
+        instance.shutdown()
+        instance.server_close()
+
+
+def test_parallel_chunked_download(server, tmp_path):
+    srv = server()
+    path = tmp_path / "model.onnx"
+    progress = []
+    Download(srv.url("model.onnx"), path, chunk_size=CHUNK, workers=4,
+             progress=lambda done, total: progress.append((done, total))).run()
+
+    assert path.read_bytes() == PAYLOAD
+    assert sorted(srv.requested) == list(range(0, len(PAYLOAD), CHUNK))
+    assert progress[-1] == (len(PAYLOAD), len(PAYLOAD))
+    assert is_complete(path)
+
+
+def test_resume_after_failed_chunk(server, tmp_path):
+    srv = server()
+    srv.fail_once.add(3 * CHUNK)
+    path = tmp_path / "model.onnx"
+    download = lambda: Download(srv.url("model.onnx"), path, chunk_size=CHUNK, workers=2).run()
+
+    with pytest.raises(Exception):
+        download()
+    assert not is_complete(path)
+    with open(state_path(path), "r", encoding="utf-8") as f:
+        done = set(json.load(f)["done"])
+    assert 3 not in done and done
+    assert os.path.getsize(path) == len(PAYLOAD)  # Preallocato alla dimensione finale
+
+    srv.requested.clear()
+    download()
+    # Solo i blocchi mancanti: quello fallito e quelli annullati dopo l'errore
+    missing = [i * CHUNK for i in range(len(PAYLOAD) // CHUNK + 1) if i not in done]
+    assert sorted(srv.requested) == missing
+    assert path.read_bytes() == PAYLOAD
+    assert is_complete(path)
+
+
+def test_checksum_mismatch_deletes_file(server, tmp_path):
+    srv = server()
+    path = tmp_path / "model.onnx"
+    with pytest.raises(DownloadError, match="Checksum"):
+        Download(srv.url("model.onnx"), path, sha256="0" * 64, chunk_size=CHUNK).run()
+    assert not os.path.exists(path)
+    assert not os.path.exists(state_path(path))
+
+    expected = hashlib.sha256(PAYLOAD).hexdigest()
+    Download(srv.url("model.onnx"), path, sha256=expected, chunk_size=CHUNK).run()
+    assert is_complete(path)
+
+
+def test_server_without_ranges_streams(server, tmp_path):
+    srv = server(ranges=False)
+    path = tmp_path / "model.onnx"
+    Download(srv.url("model.onnx"), path, chunk_size=CHUNK).run()
+
+    assert path.read_bytes() == PAYLOAD
+    assert srv.requested == []
+    assert is_complete(path)
+
+
+def test_download_model_fetches_external_data(server, tmp_path):
+    weights = os.urandom(CHUNK * 3)
+    srv = server({"model.onnx": PAYLOAD, "model.onnx.data": weights})
+    info = {"url": srv.url("model.onnx"), "path": "assets/models/phi3-light.onnx"}
+    path = download_model(info, tmp_path, workers=2)
+
+    assert open(path, "rb").read() == PAYLOAD
+    assert open(f"{path}.data", "rb").read() == weights
+    assert is_complete(path)
+
+
+def test_download_model_without_external_data(server, tmp_path):
+    srv = server()
+    path = download_model({"url": srv.url("model.onnx"), "path": "model.onnx"}, tmp_path)
+    assert open(path, "rb").read() == PAYLOAD
+    assert not os.path.exists(f"{path}.data")
@@ -0,0 +1,82 @@
+# Test di WakeWordDetector su WAV sintetici, con un riconoscitore finto al posto di PocketSphinx
+import os
+import sys
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wake_word import WakeWordDetector, WAKE_WORD, SAMPLE_RATE, MIN_ENERGY, SPEECH_RATIO
+
+
+def write_wav(path, *parts):
+    """parts: (secondi, ampiezza) in sequenza; ampiezza 0 = silenzio, altrimenti un tono a 220 Hz"""
+    rng = np.random.default_rng(0)
+    audio = []
+    for seconds, amplitude in parts:
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        audio.append(amplitude * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 20, len(t)))
+    samples = np.clip(np.concatenate(audio), -32768, 32767).astype(np.int16)
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    return str(path)
+
+
+class Spy:
+    def __init__(self, text=""):
+        self.text = text
+        self.segments = []
+        self.wakes = 0
+
+    def recognize(self, segment):
+        self.segments.append(segment)
+        return self.text
+
+    def on_wake(self):
+        self.wakes += 1
+
+
+def make_detector(spy):
+    return WakeWordDetector(recognize=spy.recognize, on_wake=spy.on_wake)
+
+
+def test_short_click_is_dropped(tmp_path):
+    spy = Spy(WAKE_WORD)
+    path = write_wav(tmp_path / "click.wav", (0.5, 0), (0.09, 8000), (1.0, 0))
+    assert make_detector(spy).process_wav(path) == 0
+    assert spy.segments == []
+    assert spy.wakes == 0
+
+
+def test_voiced_burst_wakes_once(tmp_path):
+    spy = Spy(WAKE_WORD)
+    path = write_wav(tmp_path / "ehi_arcadia.wav", (0.5, 0), (0.8, 6000), (1.0, 0))
+    detector = make_detector(spy)
+    assert detector.process_wav(path) == 1
+    assert len(spy.segments) == 1
+    assert spy.wakes == 1
+
+
+def test_other_words_do_not_wake(tmp_path):
+    spy = Spy("ehi siri")
+    path = write_wav(tmp_path / "altro.wav", (0.5, 0), (0.8, 6000), (1.0, 0))
+    assert make_detector(spy).process_wav(path) == 0
+    assert len(spy.segments) == 1
+    assert spy.wakes == 0
+
+
+def test_silence_adapts_noise_without_recognizer(tmp_path):
+    spy = Spy(WAKE_WORD)
+    path = write_wav(tmp_path / "silenzio.wav", (3.0, 0))
+    detector = make_detector(spy)
+    initial = detector.gate.noise
+    assert initial == MIN_ENERGY / SPEECH_RATIO
+
+    detector.process_wav(path)
+    assert detector.gate.noise < initial / 2  # Si avvicina al rumore reale (RMS ~20)
+    assert spy.segments == []
+    assert detector.segments == 0
@@ -0,0 +1,135 @@
+# Test di WebClient contro un server HTTP locale al posto dei servizi esterni
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_client import WebClient, WebError
+
+
+class StubServer(ThreadingHTTPServer):
+    """Risponde in JSON dopo `delay` secondi; conta le richieste e quelle contemporanee"""
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.delay = delay
+        self.hits = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, come i servizi veri
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+
+        status = 500 if self.path.startswith("/errore") else 200
+        body = json.dumps({"path": self.path}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(delay=0.0):
+        instance = StubServer(delay)
+        threading.Thread(target=instance.serve_forever, daemon=True).start()
+        servers.append(instance)
+        return instance
+
+    yield start
+    for instance in servers:
+        instance.shutdown()
+        instance.server_close()
+
+
+@pytest.fixture
+def client():
+    instance = WebClient(per_host=2, timeout=5)
+    yield instance
+    instance.close()
+
+
+def gather(client, *coroutines):
+    async def run_all():
+        return await asyncio.gather(*coroutines)
+    return client.run(run_all(), timeout=10)
+
+
+def test_identical_requests_coalesce(server, client):
+    srv = server(delay=0.3)
+    url = srv.url("/cerca?q=meteo")
+    results = gather(client, *(client.fetch_json("GET", url, cache=False) for _ in range(5)))
+
+    assert srv.hits == 1
+    assert client.coalesced == 4
+    assert all(result == {"path": "/cerca?q=meteo"} for result in results)
+
+
+def test_repeated_requests_served_from_cache(server, client):
+    srv = server()
+    first = client.get_json(srv.url("/immagine"))
+    second = client.get_json(srv.url("/immagine"))
+    assert first == second
+    assert srv.hits == 1
+
+    calls = []
+    def search(query, max_results=3):
+        calls.append(query)
+        return [{"title": query, "href": "https://example.org"}]
+
+    client.search(search, "Che tempo fa a Roma?")
+    client.search(search, "che tempo fa a roma")  # Stessa query normalizzata
+    assert calls == ["Che tempo fa a Roma?"]
+
+
+def test_per_host_limit_caps_concurrency(server, client):
+    srv = server(delay=0.2)
+    gather(client, *(client.fetch_json("GET", srv.url(f"/pagina/{i}"), cache=False) for i in range(8)))
+
+    assert srv.hits == 8
+    assert srv.max_active == 2
+
+
+def test_error_status_raises(server, client):
+    srv = server()
+    with pytest.raises(WebError) as error:
+        client.get_json(srv.url("/errore"))
+    assert error.value.status == 500
+
+
+def test_hung_search_times_out(client):
+    client.timeout = 0.2
+    release = threading.Event()
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        client.search(lambda query, max_results=3: release.wait(5), "bloccata")
+    release.set()
+    assert time.perf_counter() - start < 2
@@ -0,0 +1,173 @@
+# transcription.py
+# Trascrizione in memoria con un pool di riconoscitori Vosk condivisi tra le richieste
+# Nessun file temporaneo: l'audio decodificato viene letto tramite memoryview
+
+import os
+import json
+import queue
+import struct
+import threading
+from contextlib import contextmanager
+
+CHUNK_SIZE = 8000  # Byte passati a Vosk per ogni AcceptWaveform
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class PoolBusy(Exception):
+    """Tutti i riconoscitori sono occupati e la coda di attesa è piena"""
+
+
+def read_wav(data):
+    """Analizza l'header RIFF/WAVE e restituisce (pcm, sample_rate) senza copiare i campioni"""
+    view = memoryview(data)
+    if len(view) < 12 or view[0:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise ValueError("L'audio non è un file WAV")
+
+    pos = 12
+    sample_rate = None
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        size = struct.unpack_from("<I", view, pos + 4)[0]
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            if body + 16 > len(view):
+                raise ValueError("Chunk fmt troncato")
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", view, body)
+            if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE) or channels != 1 or bits != 16:
+                raise ValueError("Serve audio PCM 16 bit mono")
+        elif chunk_id == b"data":
+            if sample_rate is None:
+                raise ValueError("Header WAV senza chunk fmt")
+            # I WAV registrati in streaming possono dichiarare una lunghezza fittizia
+            return view[body:min(body + size, len(view))], sample_rate
+
+        pos = body + size + (size & 1)  # I chunk sono allineati a 2 byte
+
+    raise ValueError("Header WAV senza chunk data")
+
+
+def resample_pcm(pcm, sample_rate, target_rate):
+    """PCM 16 bit mono portato a target_rate (interpolazione lineare, con una media mobile
+    come filtro anti-aliasing quando si riduce la frequenza)"""
+    if sample_rate == target_rate:
+        return pcm
+    import numpy as np  # Solo per l'audio a frequenze diverse da quella del pool
+
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    width = int(sample_rate // target_rate)
+    if width > 1:
+        samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode="same")
+    length = int(len(samples) * target_rate / sample_rate)
+    positions = np.arange(length, dtype=np.float64) * (sample_rate / target_rate)
+    resampled = np.interp(positions, np.arange(len(samples)), samples)
+    return np.clip(resampled, -32768, 32767).astype(np.int16).tobytes()
+
+
+def transcribe_pcm(rec, pcm, chunk_size=CHUNK_SIZE):
+    """Passa il PCM al riconoscitore a blocchi e restituisce il testo finale"""
+    segments = []
+    for start in range(0, len(pcm), chunk_size):
+        # bytes() copia solo il blocco corrente, non l'intero buffer
+        if rec.AcceptWaveform(bytes(pcm[start:start + chunk_size])):
+            segments.append(json.loads(rec.Result())["text"])
+    segments.append(json.loads(rec.FinalResult())["text"])
+    return " ".join(s for s in segments if s)
+
+
+class RecognizerPool:
+    """Pool limitato di riconoscitori pre-costruiti, con coda di attesa e contropressione"""
+
+    def __init__(self, factory, size=None, max_waiting=None, timeout=30):
+        self.size = size or os.cpu_count() or 2
+        self.max_waiting = self.size * 2 if max_waiting is None else max_waiting
+        self.timeout = timeout
+
+        self.idle = queue.Queue()
+        for _ in range(self.size):
+            self.idle.put(factory())
+
+        # Posti totali: riconoscitori in uso + richieste in coda
+        self.slots = threading.BoundedSemaphore(self.size + self.max_waiting)
+
+    @contextmanager
+    def recognizer(self):
+        """Presta un riconoscitore; solleva PoolBusy se la coda è piena o l'attesa scade"""
+        if not self.slots.acquire(blocking=False):
+            raise PoolBusy("Troppe trascrizioni in corso")
+        try:
+            try:
+                rec = self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise PoolBusy("Tempo di attesa scaduto")
+            try:
+                yield rec
+            finally:
+                rec.Reset()
+                self.idle.put(rec)
+        finally:
+            self.slots.release()
+
+    @property
+    def in_use(self):
+        return self.size - self.idle.qsize()
+
+
+class AudioRing:
+    """Buffer circolare di frame audio preallocati tra la callback del microfono e il riconoscitore.
+    Se il consumatore resta indietro si scartano i frame più vecchi: la latenza resta limitata."""
+
+    def __init__(self, frame_bytes, capacity):
+        self.frame_bytes = frame_bytes
+        self.capacity = capacity
+        self.buffer = bytearray(frame_bytes * capacity)
+        self.view = memoryview(self.buffer)
+        self.lengths = [0] * capacity
+        self.start = 0   # Slot del frame più vecchio
+        self.count = 0   # Frame in attesa
+        self.cond = threading.Condition()
+        self.written = 0
+        self.dropped = 0
+        self.max_fill = 0
+
+    def write(self, data):
+        """Dalla callback audio: copia il frame nel suo slot, senza allocare memoria"""
+        data = memoryview(data).cast("B")
+        size = min(len(data), self.frame_bytes)
+        with self.cond:
+            if self.count == self.capacity:
+                # Pieno: il frame più vecchio lascia il posto al nuovo
+                self.start = (self.start + 1) % self.capacity
+                self.count -= 1
+                self.dropped += 1
+            slot = (self.start + self.count) % self.capacity
+            offset = slot * self.frame_bytes
+            self.view[offset:offset + size] = data[:size]
+            self.lengths[slot] = size
+            self.count += 1
+            self.written += 1
+            self.max_fill = max(self.max_fill, self.count)
+            self.cond.notify()
+
+    def read(self, timeout=None):
+        """Il frame più vecchio (copiato: lo slot può essere riscritto subito), None se scade il timeout"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.count, timeout):
+                return None
+            offset = self.start * self.frame_bytes
+            frame = bytes(self.view[offset:offset + self.lengths[self.start]])
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+            return frame
+
+    def stats(self):
+        with self.cond:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "pending": self.count,
+                "max_fill": self.max_fill,
+                "capacity": self.capacity
+            }
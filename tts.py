@@ -0,0 +1,275 @@
+# tts.py
+# Sintesi vocale a pipeline: la risposta viene divisa in frasi, la frase N+1 si sintetizza
+# mentre la N è in riproduzione e l'audio resta in memoria (nessun file mp3 condiviso).
+# Motori: gTTS (online) con ripiego su espeak-ng (offline); le frasi ricorrenti escono dalla cache.
+
+import io
+import re
+import queue
+import shutil
+import threading
+import subprocess
+from collections import OrderedDict
+
+from assistant_config import load_config
+from response_cache import normalize_prompt
+
+LANG = "it"
+PREFETCH = 2                          # Frasi sintetizzate in anticipo rispetto alla riproduzione
+MAX_SENTENCE_CHARS = 200              # Frasi più lunghe vengono spezzate alle virgole
+CACHE_BYTES = 8 * 1024 * 1024         # Audio delle frasi ricorrenti tenuto in memoria
+SYNTH_TIMEOUT = 15
+
+SENTENCE_END = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+CLAUSE_END = re.compile(r"(?<=[,])\s+")
+MARKUP = re.compile(r"\[/?[a-z]+(=[^\]]*)?\]|[*_`#]")  # Markup Kivy e Markdown delle risposte
+
+
+def split_sentences(text, max_chars=MAX_SENTENCE_CHARS):
+    """Frasi da leggere in ordine; quelle troppo lunghe vengono divise alle virgole"""
+    sentences = []
+    for sentence in SENTENCE_END.split(MARKUP.sub("", text)):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+            continue
+        chunk = ""
+        for clause in CLAUSE_END.split(sentence):
+            if chunk and len(chunk) + len(clause) + 1 > max_chars:
+                sentences.append(chunk)
+                chunk = clause
+            else:
+                chunk = f"{chunk} {clause}".strip()
+        if chunk:
+            sentences.append(chunk)
+    return sentences
+
+
+class SentenceChunker:
+    """Raccoglie i frammenti generati dal modello e restituisce le frasi appena completate"""
+
+    def __init__(self, max_chars=MAX_SENTENCE_CHARS):
+        self.max_chars = max_chars
+        self.buffer = ""
+
+    def feed(self, piece):
+        self.buffer += piece
+        boundary = None
+        for boundary in SENTENCE_END.finditer(self.buffer):
+            pass
+        if boundary is None:
+            return []
+        # La parte dopo l'ultimo confine resta in attesa della fine della frase
+        complete, self.buffer = self.buffer[:boundary.start()], self.buffer[boundary.end():]
+        return split_sentences(complete, self.max_chars)
+
+    def flush(self):
+        rest, self.buffer = self.buffer, ""
+        return split_sentences(rest, self.max_chars)
+
+
+def audio_mime(audio):
+    """Tipo dell'audio prodotto dai motori: WAV da espeak, mp3 da gTTS"""
+    return "audio/wav" if audio[:4] == b"RIFF" else "audio/mpeg"
+
+
+# --- MOTORI ---
+class GTTSEngine:
+    """Google TTS (richiede rete): mp3 scritto direttamente in un buffer in memoria"""
+    name = "gtts"
+
+    def __init__(self, lang=LANG):
+        from gtts import gTTS
+        self.gTTS = gTTS
+        self.lang = lang
+
+    def synthesize(self, sentence):
+        buffer = io.BytesIO()
+        self.gTTS(text=sentence, lang=self.lang, slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class EspeakEngine:
+    """espeak-ng locale (offline): WAV letto dallo stdout del processo"""
+    name = "espeak"
+
+    def __init__(self, lang=LANG):
+        self.executable = shutil.which("espeak-ng") or shutil.which("espeak")
+        if self.executable is None:
+            raise RuntimeError("espeak-ng non installato")
+        self.lang = lang
+
+    def synthesize(self, sentence):
+        result = subprocess.run([self.executable, "-v", self.lang, "--stdout", sentence],
+                                capture_output=True, timeout=SYNTH_TIMEOUT, check=True)
+        return result.stdout
+
+
+def load_engines(preference="auto", lang=LANG):
+    """Motori disponibili in ordine di preferenza: "auto" = gTTS, poi offline se manca la rete"""
+    order = {"auto": (GTTSEngine, EspeakEngine), "gtts": (GTTSEngine,), "offline": (EspeakEngine,)}
+    engines = []
+    for engine_class in order.get(preference, order["auto"]):
+        try:
+            engines.append(engine_class(lang))
+        except Exception as e:
+            print(f"⚠️ Motore TTS {engine_class.name} non disponibile: {e}")
+    return engines
+
+
+# --- RIPRODUZIONE ---
+class PygamePlayer:
+    """Riproduce audio (mp3/wav) da memoria; blocca per la durata del suono, senza polling"""
+
+    def __init__(self):
+        import pygame
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        self.pygame = pygame
+
+    def play(self, audio):
+        sound = self.pygame.mixer.Sound(file=io.BytesIO(audio))
+        channel = sound.play()
+        # Attesa pari alla durata: nel frattempo il produttore sintetizza la frase successiva
+        threading.Event().wait(sound.get_length())
+        if channel is not None and channel.get_busy():
+            channel.stop()
+
+
+class AudioCache:
+    """LRU dell'audio per frase, limitata in byte"""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = audio
+            self.size += len(audio)
+            while self.size > self.max_bytes:
+                self.size -= len(self.entries.popitem(last=False)[1])
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "bytes": self.size}
+
+
+class Speaker:
+    """Sintesi e riproduzione a pipeline; una sola risposta alla volta esce dall'altoparlante"""
+
+    def __init__(self, preference=None, lang=LANG, engines=None, player=None):
+        self.preference = preference
+        self.lang = lang
+        self.engines = engines
+        self.player = player
+        self.cache = AudioCache()
+        self.init_lock = threading.Lock()
+        self.playback_lock = threading.Lock()
+
+    # Motori e mixer si caricano al primo utilizzo (il server sintetizza soltanto)
+    def get_engines(self):
+        with self.init_lock:
+            if self.engines is None:
+                preference = self.preference or load_config().get("tts_engine", "auto")
+                self.engines = load_engines(preference, self.lang)
+        return self.engines
+
+    def get_player(self):
+        with self.init_lock:
+            if self.player is None:
+                try:
+                    self.player = PygamePlayer()
+                except Exception as e:
+                    print(f"⚠️ Riproduzione audio non disponibile: {e}")
+                    self.player = False
+        return self.player
+
+    def synthesize(self, sentence):
+        """Audio di una frase (dalla cache se già sintetizzata), None se tutti i motori falliscono"""
+        for engine in self.get_engines():
+            key = f"{engine.name}|{self.lang}|{normalize_prompt(sentence)}"
+            audio = self.cache.get(key)
+            if audio is not None:
+                return audio
+            try:
+                audio = engine.synthesize(sentence)
+            except Exception as e:
+                print(f"⚠️ TTS {engine.name} fallito, provo il motore successivo: {e}")
+                continue
+            self.cache.put(key, audio)
+            return audio
+        return None
+
+    def stream(self, text):
+        """Audio frase per frase; la sintesi parte subito e procede in anticipo di PREFETCH frasi"""
+        pending = queue.Queue(maxsize=PREFETCH)
+        stop = threading.Event()
+
+        def produce():
+            for sentence in split_sentences(text):
+                audio = self.synthesize(sentence)
+                if audio is not None:
+                    pending.put(audio)
+                if stop.is_set():
+                    break
+            pending.put(None)
+
+        def consume():
+            try:
+                while (audio := pending.get()) is not None:
+                    yield audio
+            finally:
+                # Consumatore interrotto: il produttore si ferma alla frase successiva
+                stop.set()
+                while not pending.empty():
+                    pending.get_nowait()
+
+        threading.Thread(target=produce, daemon=True).start()
+        return consume()
+
+    def speak(self, text, wait=True):
+        """Legge il testo: la prima frase parte appena sintetizzata, non a fine risposta"""
+        if not wait:
+            threading.Thread(target=self.speak, args=(text,), daemon=True).start()
+            return
+        player = self.get_player()
+        if not player:
+            print(f"[TTS] {text}")
+            return
+        audio_stream = self.stream(text)  # La sintesi parte subito, anche se un'altra risposta sta suonando
+        with self.playback_lock:
+            for audio in audio_stream:
+                try:
+                    player.play(audio)
+                except Exception as e:
+                    print("❌ TTS fallito:", e)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+speaker = Speaker()
+
+def speak_text(text, wait=True):
+    speaker.speak(text, wait)
@@ -6,24 +6,156 @@ import cv2
 import pytesseract
 from PIL import Image, ExifTags
 import os
+import atexit
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from PyPDF2 import PdfReader
 from pdf2image import convert_from_path
-import tempfile
 
-def analyze_image(image_path):
-    """Analizza un'immagine e restituisce una descrizione testuale"""
-    try:
-        # Apri l'immagine
-        img = Image.open(image_path)
+from assistant_config import BASE_DIR
+from response_cache import ResponseCache
+
+OCR_LANG = 'ita+eng'
+OCR_DPI = 200                     # Risoluzione di rasterizzazione per l'OCR delle pagine
+OCR_MAX_SIDE = 2000               # Lato massimo (px) dell'immagine passata a Tesseract
+STATS_SIDE = 256                  # Lato (px) della vista usata per luminosità e colore
+MAX_SKEW = 15                     # Gradi oltre i quali il testo non viene raddrizzato
+WORKERS = os.cpu_count() or 2     # Processi per OCR e analisi
+WORKER_MEMORY_LIMIT = 2 * 1024 ** 3  # Byte di memoria virtuale per processo (None = nessun limite)
+
+_process_pool = None
+_pool_lock = threading.Lock()
+_open_readers = {}  # PdfReader aperti in questo processo
+
+ATTACHMENT_CACHE_PATH = str(BASE_DIR / "attachment_cache.json")
+ATTACHMENT_CACHE_ENTRIES = 500
+ATTACHMENT_CACHE_CHARS = 20_000_000     # ~20 MB di testo al massimo
+ATTACHMENT_CACHE_TTL = 30 * 24 * 3600
+_attachment_cache = None
+
 
-        # 1. Estrai metadati Exif (data, posizione, dispositivo)
-        exif_data = {}
+class AnalysisCancelled(Exception):
+    """L'analisi non serve più (es. il client si è disconnesso)"""
+
+# --- POOL DI PROCESSI ---
+def init_worker(memory_limit):
+    """Inizializza un processo del pool: un solo thread OpenCV e un tetto alla memoria"""
+    cv2.setNumThreads(1)  # Il parallelismo è già dato dai processi
+    if memory_limit:
         try:
-            for tag, value in img._getexif().items():
-                tag_name = ExifTags.TAGS.get(tag, tag)
-                exif_data[tag_name] = str(value)
-        except:
-            pass
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"⚠️ Limite di memoria non applicato: {e}")
+
+def get_process_pool():
+    """Pool di processi condiviso per OCR e analisi (None se la piattaforma non lo supporta)"""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            try:
+                # spawn: il server ha già thread e sessioni ONNX, un fork li duplicherebbe
+                _process_pool = ProcessPoolExecutor(max_workers=WORKERS,
+                                                    mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=init_worker,
+                                                    initargs=(WORKER_MEMORY_LIMIT,))
+            except (ImportError, OSError, NotImplementedError) as e:
+                print(f"⚠️ Pool di processi non disponibile, analisi sequenziale: {e}")
+                _process_pool = False
+        return _process_pool or None
+
+def reset_process_pool(pool, error=None):
+    """Un worker è morto (ucciso per memoria, avvio fallito, initializer in errore):
+    il pool non è più utilizzabile e va ricreato"""
+    global _process_pool
+    if error is not None:
+        cause = f" ({error.__cause__})" if error.__cause__ else ""
+        print(f"⚠️ Pool di processi interrotto: {error}{cause}")
+    with _pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def run_in_pool(func, *args, **kwargs):
+    """Esegue func in un processo del pool (o qui, se il pool non è disponibile)"""
+    pool = get_process_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    try:
+        return pool.submit(func, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        reset_process_pool(pool, e)
+        raise
+
+# --- IMMAGINI ---
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)  # Larghezza e altezza scambiate dopo la rotazione
+
+def decode_flags(size, preprocess):
+    """Flag di cv2.imread: con la pre-elaborazione basta decodificare JPEG/PNG grandi a 1/2, 1/4 o 1/8"""
+    if not preprocess:
+        return cv2.IMREAD_COLOR
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(size) // factor >= OCR_MAX_SIDE:
+            return flag
+    return cv2.IMREAD_COLOR
+
+def color_stats(pixels):
+    """Luminosità e colore medio (B, G, R) su una vista sottocampionata, senza copie né conversioni"""
+    step = max(1, max(pixels.shape[:2]) // STATS_SIDE)
+    mean_b, mean_g, mean_r = pixels[::step, ::step].reshape(-1, 3).mean(axis=0)
+    # Stessi pesi di COLOR_BGR2GRAY: la media dei grigi è la combinazione delle medie dei canali
+    brightness = 0.114 * mean_b + 0.587 * mean_g + 0.299 * mean_r
+    return brightness, (mean_b, mean_g, mean_r)
+
+def deskew(binary):
+    """Raddrizza il testo ruotando secondo il rettangolo minimo che contiene i pixel scuri"""
+    coords = cv2.findNonZero(255 - binary)
+    if coords is None:
+        return binary
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if abs(angle) < 0.5 or abs(angle) > MAX_SKEW:
+        return binary  # Già dritto, o un'inclinazione troppo forte per essere testo storto
+    h, w = binary.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(binary, matrix, (w, h), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+def prepare_for_ocr(pixels, dpi=None):
+    """Scala di grigi, ridimensionamento alla risoluzione dell'OCR, binarizzazione (Otsu) e raddrizzamento"""
+    gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    scale = OCR_DPI / dpi if dpi else 1.0
+    scale = min(scale, OCR_MAX_SIDE / max(h, w))
+    if abs(scale - 1.0) > 0.05:
+        gray = cv2.resize(gray, (round(w * scale), round(h * scale)),
+                          interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return deskew(binary)
+
+def analyze_image(image_path, lang=OCR_LANG, preprocess=True):
+    """Analizza un'immagine e restituisce una descrizione testuale.
+    I pixel vengono decodificati una sola volta; con preprocess l'OCR lavora su una copia ridotta e binarizzata."""
+    try:
+        # 1. Header e metadati Exif (data, posizione, dispositivo): Image.open non decodifica i pixel
+        with Image.open(image_path) as img:
+            w, h = img.size
+            dpi = img.info.get("dpi", (None,))[0]
+            exif = img.getexif()
+
+        exif_data = {ExifTags.TAGS.get(tag, tag): str(value) for tag, value in exif.items()}
+        if exif.get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+            w, h = h, w
 
         exif_text = ""
         if "DateTime" in exif_data:
@@ -33,23 +165,25 @@ def analyze_image(image_path):
         if "Model" in exif_data:
             exif_text += f"📱 Dispositivo: {exif_data['Model']}\n"
 
-        # 2. Converti in OpenCV
-        img_cv = cv2.imread(image_path)
-        h, w, _ = img_cv.shape
+        # 2. Unica decodifica dei pixel (BGR), eventualmente già ridotta dal decoder
+        flags = decode_flags((w, h), preprocess)
+        pixels = cv2.imread(image_path, flags)
+        if pixels is None:
+            raise ValueError("formato immagine non leggibile")
+        if flags != cv2.IMREAD_COLOR and dpi:
+            dpi = dpi * pixels.shape[1] / w
 
-        # 3. Rileva se è scura o chiara
-        gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-        brightness = gray.mean()
+        # 3-4. Luminosità e colore dominante in un solo passaggio
+        brightness, (mean_b, mean_g, mean_r) = color_stats(pixels)
         lighting = "luminosa" if brightness > 100 else "scuro"
-
-        # 4. Rileva colore dominante
-        avg_color = img_cv.mean(axis=0).mean(axis=0)
-        dominant_color = "verde" if avg_color[1] > avg_color[0] and avg_color[1] > avg_color[2] else \
-                        "rosso" if avg_color[0] > avg_color[1] and avg_color[0] > avg_color[2] else \
-                        "blu" if avg_color[2] > avg_color[0] and avg_color[2] > avg_color[1] else "neutro"
+        dominant_color = "verde" if mean_g > mean_r and mean_g > mean_b else \
+                        "rosso" if mean_r > mean_g and mean_r > mean_b else \
+                        "blu" if mean_b > mean_r and mean_b > mean_g else "neutro"
 
         # 5. OCR: estrai testo
-        text = pytesseract.image_to_string(img_cv, lang='ita+eng')
+        ocr_input = prepare_for_ocr(pixels, dpi) if preprocess else pixels
+        del pixels
+        text = pytesseract.image_to_string(ocr_input, lang=lang)
         text = text.strip()
         ocr_text = f"📄 Testo trovato:\n{text}" if text else "❌ Nessun testo trovato nell'immagine."
 
@@ -67,40 +201,152 @@ def analyze_image(image_path):
     except Exception as e:
         return f"❌ Errore nell'analisi dell'immagine: {e}"
 
-def extract_text_from_pdf(pdf_path):
-    """Estrai testo da un PDF (prima pagina)"""
+# --- PDF ---
+def open_pdf(pdf_path):
+    """PdfReader riusato per tutte le pagine dello stesso file elaborate da questo processo"""
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_size, stat.st_mtime)
+    if key not in _open_readers:
+        _open_readers.clear()
+        _open_readers[key] = PdfReader(pdf_path)
+    return _open_readers[key]
+
+def extract_page(pdf_path, index, lang=OCR_LANG):
+    """Testo di una pagina (indice da 0): estrazione diretta, OCR solo se la pagina è un'immagine.
+    Restituisce (numero pagina, testo, "testo" | "ocr")"""
+    text = (open_pdf(pdf_path).pages[index].extract_text() or "").strip()
+    if text:
+        return index + 1, text, "testo"
+
+    # Rasterizza solo questa pagina e passa l'immagine PIL a Tesseract, senza file intermedi
+    images = convert_from_path(pdf_path, dpi=OCR_DPI, first_page=index + 1, last_page=index + 1)
+    text = "\n".join(pytesseract.image_to_string(image, lang=lang) for image in images)
+    return index + 1, text.strip(), "ocr"
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise AnalysisCancelled()
+
+def iter_pdf_pages(pdf_path, lang=OCR_LANG, pages=None, cancel=None):
+    """Genera (numero pagina, testo, metodo) in ordine, man mano che le pagine sono pronte.
+    pages = (prima, ultima), numerate da 1; None = tutto il documento.
+    Le pagine sono distribuite sul pool di processi, con al massimo 2 pagine in volo per worker.
+    cancel: threading.Event controllato a ogni pagina; se impostato solleva AnalysisCancelled."""
+    page_count = len(PdfReader(pdf_path).pages)
+    first, last = pages or (1, page_count)
+    indices = deque(range(max(first, 1) - 1, min(last, page_count)))
+    pool = get_process_pool() if len(indices) > 1 else None
+    if pool is None:
+        for index in indices:
+            check_cancelled(cancel)
+            yield extract_page(pdf_path, index, lang)
+        return
+
+    pending = deque()
     try:
-        reader = PdfReader(pdf_path)
-        if len(reader.pages) == 0:
-            return "❌ PDF vuoto."
+        while indices or pending:
+            check_cancelled(cancel)
+            while indices and len(pending) < WORKERS * 2:
+                pending.append(pool.submit(extract_page, pdf_path, indices.popleft(), lang))
+            try:
+                yield pending.popleft().result()
+            except BrokenProcessPool as e:
+                reset_process_pool(pool, e)
+                raise
+    finally:
+        # Generatore abbandonato: le pagine non ancora iniziate non servono più
+        for future in pending:
+            future.cancel()
 
-        # Estrai testo dalla prima pagina
-        text = reader.pages[0].extract_text()
-        if text.strip():
-            return f"📄 Testo estratto (prima pagina):\n{text.strip()}"
-
-        # Se OCR non funziona, converti in immagine e usa Tesseract
-        with tempfile.TemporaryDirectory() as path:
-            images = convert_from_path(pdf_path, single_file=True, output_folder=path)
-            for image in images:
-                temp_img = os.path.join(path, "temp.jpg")
-                image.save(temp_img, "JPEG")
-                text = pytesseract.image_to_string(temp_img, lang='ita+eng')
-                if text.strip():
-                    return f"📄 Testo estratto (OCR):\n{text.strip()}"
-        return "❌ Nessun testo leggibile nel PDF."
+def extract_text_from_pdf(pdf_path, lang=OCR_LANG, pages=None, cancel=None):
+    """Estrai il testo delle pagine di un PDF (OCR per le pagine senza testo)"""
+    try:
+        sections = []
+        page_count = 0
+        for number, text, method in iter_pdf_pages(pdf_path, lang, pages, cancel):
+            page_count += 1
+            if text:
+                label = " (OCR)" if method == "ocr" else ""
+                sections.append(f"— Pagina {number}{label} —\n{text}")
 
+        if page_count == 0:
+            return "❌ PDF vuoto."
+        if not sections:
+            return "❌ Nessun testo leggibile nel PDF."
+        return f"📄 Testo estratto ({len(sections)}/{page_count} pagine):\n" + "\n\n".join(sections)
+
+    except (BrokenProcessPool, AnalysisCancelled):
+        raise  # Gestiti da describe_attachment
     except Exception as e:
         return f"❌ Errore lettura PDF: {e}"
 
+# --- CACHE DEI RISULTATI ---
+def get_attachment_cache():
+    """Cache persistente delle descrizioni, creata al primo uso (non nei processi del pool)"""
+    global _attachment_cache
+    with _pool_lock:
+        if _attachment_cache is None:
+            _attachment_cache = ResponseCache(ATTACHMENT_CACHE_PATH, max_entries=ATTACHMENT_CACHE_ENTRIES,
+                                              ttl=ATTACHMENT_CACHE_TTL, max_chars=ATTACHMENT_CACHE_CHARS)
+            atexit.register(_attachment_cache.save)
+        return _attachment_cache
+
+def attachment_key(file_path, **options):
+    """Hash del contenuto (non del nome: i duplicati rinominati sono comuni) + opzioni di analisi"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    params = ",".join(f"{k}={options[k]}" for k in sorted(options))
+    return f"{digest.hexdigest()}|{params}"
+
 # --- FUNZIONE PRINCIPALE ---
-def describe_attachment(file_path):
-    """Descrive un allegato (immagine o PDF)"""
+def describe_attachment(file_path, lang=OCR_LANG, pages=None, preprocess=True, use_cache=True, cancel=None):
+    """Descrive un allegato (immagine o PDF); gli allegati già visti escono dalla cache.
+    cancel: threading.Event che interrompe l'analisi (tra una pagina e l'altra per i PDF)"""
     ext = os.path.splitext(file_path)[1].lower()
 
     if ext in [".jpg", ".jpeg", ".png", ".bmp", ".tiff"]:
-        return analyze_image(file_path)
+        # Decodifica, OpenCV e Tesseract girano nel pool di processi (le pagine dei PDF già ci vanno)
+        analyze, options = partial(run_in_pool, analyze_image), {"lang": lang, "preprocess": preprocess}
     elif ext == ".pdf":
-        return extract_text_from_pdf(file_path)
+        analyze = partial(extract_text_from_pdf, cancel=cancel)
+        options = {"lang": lang, "pages": tuple(pages) if pages else None}
     else:
         return "❌ Tipo di file non supportato. Solo immagini e PDF."
+
+    cache = get_attachment_cache() if use_cache else None
+    key = attachment_key(file_path, kind=ext.strip("."), **options) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        check_cancelled(cancel)
+        description = analyze(file_path, **options)
+    except BrokenProcessPool:
+        # La causa (memoria, avvio del worker...) è nel log di reset_process_pool
+        return "❌ Analisi interrotta: riprova tra poco."
+    except AnalysisCancelled:
+        return "❌ Analisi annullata."
+    # Gli errori non si salvano: potrebbero dipendere da un problema temporaneo
+    if cache and not description.startswith("❌"):
+        cache.put(key, description)
+    return description
+
+def describe_attachments(file_paths, **options):
+    """Analisi di più allegati: genera (indice, descrizione) man mano che i file sono pronti.
+    Un thread per core coordina i file; decodifica e OCR girano nel pool di processi.
+    Se il generatore viene chiuso (client disconnesso) i file già in analisi si fermano alla pagina successiva."""
+    cancel = threading.Event()
+    with ThreadPoolExecutor(max_workers=WORKERS) as threads:
+        futures = {threads.submit(describe_attachment, path, cancel=cancel, **options): i
+                   for i, path in enumerate(file_paths)}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
@@ -1,77 +1,198 @@
-# wake_word.py
-import speech_recognition as sr
-import threading
-import time
-import subprocess
-import os
-
-# --- CONFIGURAZIONE ---
-WAKE_WORD = "ehi arcadia"  # Parola chiave (tutto minuscolo)
-LISTENING_TIMEOUT = 5       # Massimo tempo di ascolto dopo wake word
-SILENCE_TIMEOUT = 0.5       # Tempo di attesa prima di riprendere l'ascolto
-DEVICE_INDEX = None         # Imposta se hai più microfoni (usa sr.Microphone.list_microphone_names())
-
-# Riconoscitore
-r = sr.Recognizer()
-r.energy_threshold = 300    # Sensibilità (puoi regolarla)
-r.dynamic_energy_threshold = True
-
-def listen_for_wake_word():
-    """Ascolta continuamente per la wake word"""
-    print("👂 In ascolto per 'Ehi Arcadia'... (premi Ctrl+C per fermare)")
-    while True:
-        try:
-            with sr.Microphone(device_index=DEVICE_INDEX) as source:
-                r.adjust_for_ambient_noise(source, duration=0.5)  # Adatta al rumore ambiente
-                print("🟢 Ascolto...", end="\r")
-
-                # Ascolta una breve frase
-                audio = r.listen(source, phrase_time_limit=2, timeout=5)
-
-            # Riconoscimento offline con PocketSphinx
-            text = r.recognize_sphinx(audio).lower()
-            print(f"🎙️  Riconosciuto: '{text}'")
-
-            if WAKE_WORD in text:
-                print("✅ Wake word rilevata! Avvio assistente...")
-                on_wake()
-
-        except sr.UnknownValueError:
-            # Audio non chiaro, ignora e continua
-            pass
-        except sr.RequestError as e:
-            print(f"❌ Errore riconoscimento: {e}")
-        except KeyboardInterrupt:
-            print("\n👋 Interruzione rilevata. Uscita...")
-            break
-        except Exception as e:
-            print(f"⚠️  Errore: {e}")
-
-        # Breve pausa per ridurre carico CPU
-        time.sleep(SILENCE_TIMEOUT)
-
-def on_wake():
-    """Aziona l'assistente principale (es. apri interfaccia Flask o fai partire chat vocale)"""
-    # Opzione 1: Apri il browser
-    # os.system("xdg-open http://localhost:5000")  # Linux
-    # os.system("open http://localhost:5000")     # macOS
-    # os.system("start http://localhost:5000")    # Windows
-
-    # Opzione 2: Attiva un comando (es. suonare un beep)
-    print("\a")  # Beep di conferma
-
-    # Opzione 3: Invia un segnale al tuo server Flask (es. tramite WebSocket o file flag)
-    # Es. crea un file temporaneo per segnalare il wake
-    with open("wake_flag.txt", "w") as f:
-        f.write("1")
-
-    # Dopo 1 secondo, cancella il flag
-    threading.Timer(1.0, lambda: os.remove("wake_flag.txt") if os.path.exists("wake_flag.txt") else None).start()
-
-    # Opzione 4: Avvia un comando vocale (es. registrazione vera e propria con Whisper locale)
-    # Qui puoi chiamare un altro script che usa il tuo modello Phi-2
-    # subprocess.run(["python", "voice_command.py"])
-
-# --- AVVIO ---
-if __name__ == "__main__":
-    listen_for_wake_word()
+# wake_word.py
+# Ascolto continuo di "ehi arcadia" a basso consumo: lo stream del microfono resta aperto,
+# un filtro di energia (VAD) scarta il silenzio e solo i segmenti con voce passano
+# a PocketSphinx, in modalità keyword spotting limitata alla parola chiave.
+import numpy as np
+import threading
+import wave
+import sys
+import os
+from collections import deque
+
+# --- CONFIGURAZIONE ---
+WAKE_WORD = "ehi arcadia"  # Parola chiave (tutto minuscolo)
+KEYWORD_SENSITIVITY = 0.8   # 0-1: più alto = più rilevamenti (e più falsi positivi)
+DEVICE_INDEX = None         # Imposta se hai più microfoni (usa sr.Microphone.list_microphone_names())
+SAMPLE_RATE = 16000
+FRAME_MS = 30               # Durata di un frame analizzato dal VAD
+
+# Filtro di energia (VAD)
+MIN_ENERGY = 300            # RMS minimo (campioni int16) per considerare un frame come voce
+SPEECH_RATIO = 3.0          # Un frame è voce se supera di tanto il rumore di fondo
+NOISE_ADAPT = 0.05          # Velocità di adattamento del rumore di fondo (solo sui frame senza voce)
+START_MS = 90               # Voce continua necessaria per aprire un segmento
+HANGOVER_MS = 300           # Silenzio che chiude un segmento
+PREROLL_MS = 300            # Audio conservato prima dell'inizio della voce
+MIN_SEGMENT_MS = 300        # Voce minima di un segmento (senza preroll e silenzio finale): colpi e click si scartano
+MAX_SEGMENT_MS = 2500       # "Ehi Arcadia" dura meno: oltre si chiude comunque
+
+def frame_energy(frame):
+    """RMS di un frame PCM 16 bit"""
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples))) if len(samples) else 0.0
+
+class VoiceActivityGate:
+    """Divide lo stream audio in segmenti con voce, con un rumore di fondo che si adatta all'ambiente"""
+
+    def __init__(self, frame_ms=FRAME_MS):
+        self.start_frames = max(1, START_MS // frame_ms)
+        self.hangover_frames = max(1, HANGOVER_MS // frame_ms)
+        self.min_frames = MIN_SEGMENT_MS // frame_ms
+        self.max_frames = MAX_SEGMENT_MS // frame_ms
+        self.noise = MIN_ENERGY / SPEECH_RATIO
+        self.preroll = deque(maxlen=max(self.start_frames, PREROLL_MS // frame_ms))
+        self.segment = None
+        self.frames = 0
+        self.voiced_frames = 0  # Frame con voce nel segmento, esclusi preroll e silenzio finale
+        self.voiced_run = 0
+        self.silent_run = 0
+
+    def push(self, frame):
+        """Aggiunge un frame; restituisce l'audio di un segmento appena concluso, altrimenti None"""
+        energy = frame_energy(frame)
+        voiced = energy > max(MIN_ENERGY, self.noise * SPEECH_RATIO)
+        if not voiced:
+            self.noise += NOISE_ADAPT * (energy - self.noise)
+
+        if self.segment is None:
+            self.preroll.append(frame)
+            self.voiced_run = self.voiced_run + 1 if voiced else 0
+            if self.voiced_run >= self.start_frames:
+                self.segment = bytearray(b"".join(self.preroll))
+                self.frames = len(self.preroll)
+                self.voiced_frames = self.voiced_run
+                self.silent_run = 0
+                self.preroll.clear()
+            return None
+
+        self.segment += frame
+        self.frames += 1
+        self.voiced_frames += voiced
+        self.silent_run = 0 if voiced else self.silent_run + 1
+        if self.silent_run < self.hangover_frames and self.frames < self.max_frames:
+            return None
+
+        segment, self.segment = bytes(self.segment), None
+        self.voiced_run = 0
+        return segment if self.voiced_frames >= self.min_frames else None
+
+def sphinx_keyword_spotter(sample_rate=SAMPLE_RATE):
+    """Riconoscitore offline limitato alla wake word: restituisce il testo trovato o ''"""
+    import speech_recognition as sr  # Solo qui e nell'ascolto: VAD e detector bastano di numpy
+
+    recognizer = sr.Recognizer()
+
+    def recognize(segment):
+        try:
+            audio = sr.AudioData(segment, sample_rate, 2)
+            return recognizer.recognize_sphinx(audio, keyword_entries=[(WAKE_WORD, KEYWORD_SENSITIVITY)]).lower()
+        except sr.UnknownValueError:
+            return ""
+
+    return recognize
+
+def on_wake():
+    """Aziona l'assistente principale (es. apri interfaccia Flask o fai partire chat vocale)"""
+    # Opzione 1: Apri il browser
+    # os.system("xdg-open http://localhost:5000")  # Linux
+    # os.system("open http://localhost:5000")     # macOS
+    # os.system("start http://localhost:5000")    # Windows
+
+    # Opzione 2: Attiva un comando (es. suonare un beep)
+    print("\a")  # Beep di conferma
+
+    # Opzione 3: Invia un segnale al tuo server Flask (es. tramite WebSocket o file flag)
+    # Es. crea un file temporaneo per segnalare il wake
+    with open("wake_flag.txt", "w") as f:
+        f.write("1")
+
+    # Dopo 1 secondo, cancella il flag
+    threading.Timer(1.0, lambda: os.remove("wake_flag.txt") if os.path.exists("wake_flag.txt") else None).start()
+
+    # Opzione 4: Avvia un comando vocale (es. registrazione vera e propria con Whisper locale)
+    # Qui puoi chiamare un altro script che usa il tuo modello Phi-2
+    # subprocess.run(["python", "voice_command.py"])
+
+class WakeWordDetector:
+    """Frame audio → VAD → keyword spotting; il riconoscitore è sostituibile (es. nei test)"""
+
+    def __init__(self, recognize=None, on_wake=on_wake, sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS):
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.gate = VoiceActivityGate(frame_ms)
+        self.recognize = recognize or sphinx_keyword_spotter(sample_rate)
+        self.on_wake = on_wake
+        self.segments = 0     # Segmenti passati al riconoscitore
+        self.detections = 0
+
+    def process(self, frame):
+        """Elabora un frame PCM 16 bit mono; True se ha appena rilevato la wake word"""
+        segment = self.gate.push(frame)
+        if segment is None:
+            return False
+
+        self.segments += 1
+        text = self.recognize(segment)
+        if WAKE_WORD not in text:
+            return False
+        print("✅ Wake word rilevata! Avvio assistente...")
+        self.detections += 1
+        self.on_wake()
+        return True
+
+    def process_wav(self, path):
+        """Elabora un file WAV registrato come se arrivasse dal microfono; restituisce i rilevamenti"""
+        with wave.open(path, "rb") as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != 2 or wav.getframerate() != self.sample_rate:
+                raise ValueError(f"Serve un WAV PCM 16 bit mono a {self.sample_rate} Hz")
+            detections = self.detections
+            while True:
+                frame = wav.readframes(self.frame_samples)
+                if len(frame) < self.frame_samples * 2:
+                    break
+                self.process(frame)
+
+        # Silenzio finale: chiude un eventuale segmento ancora aperto
+        silence = bytes(self.frame_samples * 2)
+        for _ in range(self.gate.hangover_frames):
+            self.process(silence)
+        return self.detections - detections
+
+    def listen(self, device_index=DEVICE_INDEX):
+        """Stream del microfono sempre aperto: nessuna ricalibrazione o pausa tra una frase e l'altra"""
+        import speech_recognition as sr
+
+        with sr.Microphone(device_index=device_index, sample_rate=self.sample_rate,
+                           chunk_size=self.frame_samples) as source:
+            while True:
+                self.process(source.stream.read(self.frame_samples))
+
+def listen_for_wake_word():
+    """Ascolta continuamente per la wake word"""
+    import speech_recognition as sr
+
+    print("👂 In ascolto per 'Ehi Arcadia'... (premi Ctrl+C per fermare)")
+    detector = WakeWordDetector()
+    while True:
+        try:
+            detector.listen()
+        except KeyboardInterrupt:
+            print("\n👋 Interruzione rilevata. Uscita...")
+            break
+        except sr.RequestError as e:
+            print(f"❌ Errore riconoscimento: {e}")
+            break
+        except Exception as e:
+            # Microfono scollegato o stream interrotto: si riapre
+            print(f"⚠️  Errore: {e}")
+
+# --- AVVIO ---
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Prova offline su registrazioni: python wake_word.py registrazione.wav ...
+        detector = WakeWordDetector()
+        for path in sys.argv[1:]:
+            found = detector.process_wav(path)
+            print(f"{path}: {found} rilevamenti su {detector.segments} segmenti con voce")
+    else:
+        listen_for_wake_word()
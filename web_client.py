@@ -0,0 +1,148 @@
+# web_client.py
+# Client HTTP asincrono condiviso per i servizi esterni (@cerca, @immagine).
+# Un solo event loop in un thread dedicato con connessioni keep-alive riusate, un limite
+# di richieste contemporanee per host, la fusione delle richieste identiche ancora in corso
+# e una cache in memoria dei risultati.
+
+import json
+import asyncio
+import hashlib
+import threading
+from functools import partial
+from urllib.parse import urlsplit
+
+from response_cache import ResponseCache, normalize_prompt
+
+MAX_CONNECTIONS = 16
+PER_HOST_LIMIT = 4
+KEEPALIVE_SECONDS = 60
+TIMEOUT = 20
+CACHE_ENTRIES = 256
+CACHE_TTL = 10 * 60
+
+
+class WebError(Exception):
+    """Risposta HTTP non valida da un servizio esterno"""
+
+    def __init__(self, status, message=""):
+        super().__init__(message or f"HTTP {status}")
+        self.status = status
+
+
+def request_key(*parts):
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class WebClient:
+    """Le chiamate sincrone (dai thread di Flask o di Kivy) attendono il risultato calcolato sul loop condiviso"""
+
+    def __init__(self, per_host=PER_HOST_LIMIT, timeout=TIMEOUT,
+                 cache_entries=CACHE_ENTRIES, cache_ttl=CACHE_TTL):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.cache = ResponseCache(max_entries=cache_entries, ttl=cache_ttl)
+        self.lock = threading.Lock()
+        self.loop = None
+        self.session = None
+        self.limits = {}    # host -> semaforo
+        self.inflight = {}  # chiave -> task in corso, condiviso dalle richieste identiche
+        self.coalesced = 0
+
+    # --- Event loop ---
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        return self.loop
+
+    def run(self, coroutine, timeout=None):
+        """Esegue una coroutine sul loop condiviso e ne attende il risultato"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.start())
+        return future.result(timeout)
+
+    def close(self):
+        if self.loop is None:
+            return
+        if self.session is not None:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop = self.session = None
+        self.limits = {}
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            # aiohttp pesa ~300 ms all'import: si carica alla prima richiesta, non all'avvio
+            try:
+                import aiohttp
+            except ImportError:
+                raise RuntimeError("aiohttp non installato")
+            connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=self.per_host,
+                                             keepalive_timeout=KEEPALIVE_SECONDS)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    # --- Fusione e cache ---
+    async def shared(self, key, factory, cache=True):
+        """Un solo calcolo per chiave: le richieste identiche attendono lo stesso task"""
+        if cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield: se un chiamante rinuncia, gli altri continuano ad attendere il risultato
+        result = await asyncio.shield(task)
+        if cache and result is not None:
+            self.cache.put(key, result)
+        return result
+
+    # --- Richieste ---
+    async def request_json(self, method, url, payload=None, params=None):
+        host = urlsplit(url).netloc
+        limit = self.limits.setdefault(host, asyncio.Semaphore(self.per_host))
+        session = await self.get_session()
+        async with limit:
+            async with session.request(method, url, json=payload, params=params) as response:
+                if not 200 <= response.status < 300:
+                    raise WebError(response.status)
+                return await response.json(content_type=None)
+
+    async def fetch_json(self, method, url, payload=None, params=None, cache=True):
+        key = request_key(method, url, payload, params)
+        return await self.shared(key, partial(self.request_json, method, url, payload, params), cache)
+
+    async def call(self, key, func, *args, cache=True):
+        """Funzione bloccante (es. una libreria sincrona) eseguita in un thread, con fusione e cache.
+        Stesso limite di tempo di request_json: oltre, il chiamante riceve TimeoutError
+        (il thread non si può interrompere e finisce per conto suo)"""
+        loop = asyncio.get_running_loop()
+
+        async def in_thread():
+            return await asyncio.wait_for(loop.run_in_executor(None, partial(func, *args)), self.timeout)
+
+        return await self.shared(key, in_thread, cache)
+
+    # --- API sincrona per i comandi ---
+    def post_json(self, url, payload, cache=True, timeout=None):
+        return self.run(self.fetch_json("POST", url, payload, cache=cache), timeout)
+
+    def get_json(self, url, params=None, cache=True, timeout=None):
+        return self.run(self.fetch_json("GET", url, params=params, cache=cache), timeout)
+
+    def search(self, search_function, query, max_results=3, timeout=None):
+        """Ricerca web: query equivalenti (maiuscole, punteggiatura) condividono il risultato"""
+        key = request_key("search", normalize_prompt(query), max_results)
+        return self.run(self.call(key, partial(search_function, query, max_results=max_results)), timeout)
+
+    def stats(self):
+        return {**self.cache.stats(), "inflight": len(self.inflight), "coalesced": self.coalesced}